@@ -0,0 +1,191 @@
+#!/usr/bin/python
+########################################################################################################
+#                                                                                                      #
+# Program note:                                                                                        #
+#     Benchmark for RankedPositionalWeightMethod.py. Random assembly lines are generated from a seed,  #
+#     written in the same four text files the script reads, and every stage of the script is timed    #
+#     on them: reading the files, the positional weights, calculateRPW at the takt time and at the     #
+#     highest task time, createReport, and drawing the figures.                                        #
+#     The results can be saved as a baseline, and a later run compared against it, a stage that has   #
+#     slowed down (or grown in memory) by more than the tolerance fails the comparison.                #
+#                                                                                                      #
+#     python RankedPositionalWeightBenchmark.py --sizes 100,1000,10000 --save-baseline baseline.json   #
+#     python RankedPositionalWeightBenchmark.py --sizes 100,1000,10000 --baseline baseline.json        #
+#                                                                                                      #
+########################################################################################################
+
+import numpy as np
+import sys, os
+import argparse
+import contextlib
+import json
+import tempfile
+import time
+import tracemalloc
+
+import RankedPositionalWeightMethod as rpw
+
+# function to generate a random assembly line and write it to the four text files
+#~numTasks:     number of tasks on the line
+#~density:      average number of successors of a task, the successors are drawn from the tasks that come
+#~              shortly after it (within 'window' tasks) so the line keeps the long, layered shape of a real
+#~              assembly line rather than becoming one big tangle
+#~distribution: the task time distribution, 'uniform', 'normal', 'exponential' or 'lognormal', all with a
+#~              mean of meanTime
+#~The task numbers only ever point forward, so the precedence never has a loop.
+def generateLine(lineDir, numTasks, density, distribution, seed, meanTime=10.0, window=50):
+    rng = np.random.default_rng(seed)
+    if distribution == 'uniform':
+        taskTimes = rng.uniform(0.2*meanTime, 1.8*meanTime, numTasks)
+    elif distribution == 'normal':
+        taskTimes = np.clip(rng.normal(meanTime, 0.3*meanTime, numTasks), 0.05*meanTime, None)
+    elif distribution == 'exponential':
+        taskTimes = rng.exponential(meanTime, numTasks) + 0.01*meanTime
+    elif distribution == 'lognormal':
+        taskTimes = rng.lognormal(np.log(meanTime) - 0.125, 0.5, numTasks)
+    else:
+        raise ValueError("Unknown task time distribution: " + distribution)
+
+    # every task but the last gets at least one successor, the rest of the edges are spread at random
+    numEdges = max(int(round(density*numTasks)), numTasks-1)
+    sources = np.concatenate(( np.arange(numTasks-1), rng.integers(0, numTasks-1, numEdges-(numTasks-1)) ))
+    targets = sources + 1 + np.minimum(rng.geometric(4.0/window, len(sources)) - 1, window - 1)
+    targets = np.minimum(targets, numTasks-1)
+    edges = np.unique(np.column_stack((sources, targets)), axis=0) + 1
+
+    os.makedirs(lineDir, exist_ok=True)
+    with open(lineDir + "/" + rpw.tasktimes_file, 'w') as f:
+        f.write("\n".join( "{:.2f}".format(k) for k in taskTimes ) + "\n")
+    with open(lineDir + "/" + rpw.taskNames_file, 'w') as f:
+        f.write("\n".join( "Task " + str(k) for k in range(1, numTasks+1) ) + "\n")
+    with open(lineDir + "/" + rpw.edges_nodes_file, 'w') as f:
+        f.write("\n".join( str(u) + "," + str(v) for u, v in edges.tolist() ) + "\n")
+    with open(lineDir + "/" + rpw.workdays_worktime_annualDemand_file, 'w') as f:
+        # a demand that needs roughly one station for every 8 tasks
+        f.write("280,7,{:.0f}\n".format(280*7*3600/(8*meanTime)))
+# End of generateLine()
+
+# function to time one stage, the best of 'repeat' runs, and its peak memory in a separate traced run
+#~Returns the result of the stage, its time in seconds and its peak memory in bytes
+def timeStage(stage, repeat):
+    seconds = float('inf')
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for k in range(repeat):
+            start = time.perf_counter()
+            result = stage()
+            seconds = min(seconds, time.perf_counter() - start)
+
+        tracemalloc.start()
+        stage()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+# End of timeStage()
+
+# function to run all the stages of the script on one generated line
+#~Returns { stage: { 'seconds': ..., 'peak bytes': ... } }
+def benchmarkLine(lineDir, args):
+    results = {}
+    def record(name, stage):
+        result, seconds, peak = timeStage(stage, args.repeat)
+        results[name] = { 'seconds': seconds, 'peak bytes': peak }
+        return result
+
+    line, worktimeDemand = record('parse', lambda: rpw.loadLineText(lineDir))
+    workdays, workhours, demand = worktimeDemand
+    totalworktime = workdays * workhours * rpw.timeMultiplier['sec']
+    takttime = totalworktime / demand
+    maxTaskTime = float(line.times.max())
+
+    rpw_weights = record('positional weights', lambda: rpw.calculatePositionalWeights(line))
+    G_takt_balanced = record('calculateRPW (takt)', lambda: rpw.calculateRPW(line, takttime, rpw_weights))
+    G_highest_balanced = record('calculateRPW (highest)', lambda: rpw.calculateRPW(line, maxTaskTime, rpw_weights))
+
+    reportVarList = { 'workdays': workdays, 'workhours': workhours, 'totalworktime': totalworktime,
+                      'unit for cal': 'sec', 'takttime': takttime, 'demand': demand, 'G': line,
+                      'G_takt_balanced': G_takt_balanced, 'G_highest_balanced': G_highest_balanced }
+    record('createReport', lambda: rpw.createReport(reportVarList, lineDir + "/" + "Line_Balancing_Report.txt"))
+
+    if line.numTasks <= args.render_max:
+        renderJobs = [ ('graph', line, lineDir + "/" + "rpw_out.png", "Unbalanced line"),
+                       ('graph', G_takt_balanced, lineDir + "/" + "rpw_out_takt_balanced.png", "Balanced line using takt time"),
+                       ('graph', G_highest_balanced, lineDir + "/" + "rpw_out_highest_balanced.png", "Balanced line using highest time") ]
+        record('render', lambda: rpw.renderAll(renderJobs, parallel=False))
+    return results
+# End of benchmarkLine()
+
+# function to compare the results against a baseline
+#~A stage fails when it takes more than (1 + tolerance) times its baseline time, or the same for memory.
+#~Times below minSeconds are too short to compare reliably and are only reported.
+#~Returns the list of failures
+def compareBaseline(results, baseline, tolerance, minSeconds=0.005):
+    failures = list()
+    print("  {:<36} {:<24} {:>12} {:>12} {:>8}".format("case", "stage", "baseline", "now", "ratio"))
+    for case, stages in results.items():
+        for stage, now in stages.items():
+            before = baseline.get(case, {}).get(stage)
+            if before is None:
+                continue
+            for measure, scale, unit in (('seconds', 1e3, 'ms'), ('peak bytes', 1/1024/1024, 'MB')):
+                ratio = now[measure]/before[measure] if before[measure] > 0 else 1.0
+                failed = ratio > 1 + tolerance and not (measure == 'seconds' and before[measure] < minSeconds)
+                print("  {:<36} {:<24} {:>10.2f}{:<2} {:>10.2f}{:<2} {:>8.2f} {}".format(case, stage + " " + unit, before[measure]*scale, "",
+                      now[measure]*scale, "", ratio, "FAILED" if failed else ""))
+                if failed:
+                    failures.append( (case, stage, measure, ratio) )
+    return failures
+# End of compareBaseline()
+
+def cmdLineArgs(argv):
+    parser = argparse.ArgumentParser(description="Benchmark for the Ranked Positional Weight Method script")
+    parser.add_argument("--sizes", default="100,1000,10000",
+            help="Comma separated number of tasks of the generated lines, from 100 up to 100000.")
+    parser.add_argument("--densities", default="1.5",
+            help="Comma separated average number of successors per task.")
+    parser.add_argument("--distributions", default="uniform",
+            help="Comma separated task time distributions: uniform, normal, exponential, lognormal.")
+    parser.add_argument("--seed", type=int, default=2022, help="Seed for the line generator.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of each stage, the best is kept.")
+    parser.add_argument("--render-max", type=int, default=500,
+            help="Only time drawing the figures for lines with at most this many tasks.")
+    parser.add_argument("--out", default=None, help="Directory for the generated lines, a temporary directory by default.")
+    parser.add_argument("--save-baseline", default=None, help="Save the results to this file as the baseline.")
+    parser.add_argument("--baseline", default=None, help="Compare the results against this baseline file.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+            help="Allowed slow down (or memory growth) against the baseline, 0.25 = 25%%.")
+    return parser.parse_args(argv)
+#~End of cmdLineArgs()
+
+def main(argv):
+    args = cmdLineArgs(argv)
+    outDir = args.out or tempfile.mkdtemp(prefix="rpw-bench-")
+
+    results = {}
+    for numTasks in [ int(k) for k in args.sizes.split(',') ]:
+        for density in [ float(k) for k in args.densities.split(',') ]:
+            for distribution in args.distributions.split(','):
+                case = "{}-tasks-{}-density-{}".format(numTasks, density, distribution)
+                lineDir = os.path.join(outDir, case)
+                generateLine(lineDir, numTasks, density, distribution, args.seed)
+                results[case] = benchmarkLine(lineDir, args)
+                print("  " + case)
+                [ print("      {:<24} {:>10.2f} ms {:>10.2f} MB".format(stage, k['seconds']*1e3, k['peak bytes']/1024/1024)) for stage, k in results[case].items() ]
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("Baseline saved to " + args.save_baseline)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failures = compareBaseline(results, baseline, args.tolerance)
+        if failures:
+            print(str(len(failures)) + " stages regressed against " + args.baseline)
+            return 1
+        print("No regressions against " + args.baseline)
+    return 0
+# End of main()
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
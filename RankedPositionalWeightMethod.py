@@ -17,48 +17,341 @@
 #                                                                                                      #
 ########################################################################################################
 
-import networkx as nx
-import pylab as plt
-from networkx.drawing.nx_agraph import graphviz_layout, to_agraph
-import pygraphviz as pgv
+# networkx, pygraphviz and matplotlib are only imported by the functions that draw the figures, so a run
+# that does not draw anything, or a program that imports this one for balance(), does not load them
 import numpy as np
-import matplotlib.pyplot as myplt
-import matplotlib.image as mpimg
 import sys, os
-import re
+import csv
+import array
+import concurrent.futures
+import glob
+import json
+import hashlib
+import shutil
+import signal
+import tempfile
+import zipfile
 import argparse
+import contextlib
+import copy
+import threading
 from datetime import datetime
 from datetime import date
 import time
 
-scriptName = ""
-scriptVersion = ""
+scriptName = os.path.realpath(__file__)
+scriptVersion = "1.00"
 
 tasktimes_file = 'tasktime.txt'
 taskNames_file = 'tasknames.txt'
 edges_nodes_file = 'edges_nodes.txt'
 workdays_worktime_annualDemand_file = 'demand_worktime.txt'
+line_file = 'line.npz'
+incremental_file = 'Line_Balancing_State.npz'
+taskdist_file = 'taskdist.txt'
 timeMultiplier = {'hrs':1, 'min':60, 'sec':3600}
+cacheFormat = 5    # bump when the cached balancing results change layout
+incrementalFormat = 1    # bump when the saved IncrementalBalancer state changes layout
 
-def getDataFromFiles(workingDir):
-    # Begin by reading in the data from text files
-    with open(workingDir + "/" + tasktimes_file) as f:
-        taskTimes = f.read().splitlines()
-    
-    with open(workingDir + "/" + taskNames_file) as f:
-        taskNames = f.read().splitlines()
-    
-    with open(workingDir + "/" + edges_nodes_file) as f:
-        edges_nodes = f.read().splitlines()
-    
-    with open(workingDir + "/" + workdays_worktime_annualDemand_file) as f:
-        worktimeDemand = f.read().splitlines()
+# pipeline profiler, turned on with --profile
+#~stage(name) times a block of the pipeline, and count(name, n) adds to a counter. When the profiler is off
+#~stage() hands back one shared do-nothing context and count() returns straight away, so the calls stay in
+#~the code for production runs. The times are taken from time.perf_counter_ns(), the system wide monotonic
+#~clock on linux, so the times recorded by the render workers line up with the main process.
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.events = list()
+        self.counters = dict()
+
+    def stage(self, name):
+        if not self.enabled:
+            return nullStage
+        return ProfileStage(self, name)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # add a stage that was timed elsewhere, e.g. in a render worker
+    def addEvent(self, name, start, duration, pid=None):
+        if self.enabled:
+            self.events.append( { 'name': name, 'start': start, 'duration': duration, 'pid': pid or os.getpid() } )
+
+    # the total, number of calls and mean of each stage, in milliseconds
+    def summary(self):
+        stages = dict()
+        for event in self.events:
+            stage = stages.setdefault(event['name'], { 'calls': 0, 'total ms': 0.0 })
+            stage['calls'] += 1
+            stage['total ms'] += event['duration']/1e6
+        for stage in stages.values():
+            stage['mean ms'] = stage['total ms']/stage['calls']
+        return { 'version': scriptVersion, 'stages': stages, 'counters': dict(self.counters) }
+
+    # Chrome trace-event format, open the file in chrome://tracing or https://ui.perfetto.dev
+    def writeChromeTrace(self, fname):
+        origin = min([ k['start'] for k in self.events ], default=0)
+        traceEvents = [ { 'name': k['name'], 'cat': 'rpw', 'ph': 'X', 'pid': k['pid'], 'tid': k['pid'],
+                          'ts': (k['start']-origin)/1e3, 'dur': k['duration']/1e3 } for k in self.events ]
+        traceEvents += [ { 'name': name, 'cat': 'rpw', 'ph': 'C', 'pid': os.getpid(), 'ts': 0, 'args': { 'value': value } }
+                         for name, value in self.counters.items() ]
+        with open(fname, 'w') as f:
+            json.dump({ 'traceEvents': traceEvents, 'displayTimeUnit': 'ms' }, f)
+
+    def writeSummary(self, fname):
+        summary = self.summary()
+        with open(fname, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print("  {:<52} {:>8} {:>12} {:>12}".format("stage", "calls", "total ms", "mean ms"))
+        [ print("  {:<52} {:>8} {:>12.3f} {:>12.3f}".format(name, k['calls'], k['total ms'], k['mean ms'])) for name, k in summary['stages'].items() ]
+        [ print("  {:<52} {:>8}".format(name, value)) for name, value in summary['counters'].items() ]
+
+    def clear(self):
+        self.events = list()
+        self.counters = dict()
+# End of Profiler
+
+class ProfileStage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.addEvent(self.name, self.start, time.perf_counter_ns() - self.start)
+        return False
+# End of ProfileStage
+
+nullStage = contextlib.nullcontext()
+profiler = Profiler()
+
+# function to build compressed sparse rows (CSR) from an edge list
+#~Returns indptr, indices; the entries of row i are indices[indptr[i]:indptr[i+1]], in the order of the edges
+def buildCSR(rowIds, colIds, numRows):
+    order = np.argsort(rowIds, kind='stable')
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rowIds, minlength=numRows)))).astype(np.int64)
+    return indptr, np.asarray(colIds, dtype=np.int64)[order]
+# End of buildCSR()
+
+# the line model, an array backed description of the assembly line
+#~The tasks are numbered 0..N-1, with:
+#~  times   - NumPy array of the task times
+#~  ids     - the task number used in the input files and in the report, '1', '2', ...
+#~  names   - the task names, interned
+#~  succIndptr, succIndices - the successors of task i are succIndices[succIndptr[i]:succIndptr[i+1]]
+#~  predIndptr, predIndices - the predecessors, in the same layout
+#~to_networkx() gives the digraph that plotGraph() draws, the balancing and the report work on the arrays.
+class LineModel:
+    def __init__(self, taskTimes, edges, names=None, ids=None):
+        self.times = np.asarray(taskTimes, dtype=float)
+        self.ids = list(ids) if ids is not None else [ str(k) for k in range(1, len(self.times)+1) ]
+        self.names = [ sys.intern(str(k)) for k in names ] if names is not None else list(self.ids)
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        if len(edges) and (edges.min() < 0 or edges.max() >= len(self.times)):
+            raise ValueError("An edge refers to a task that does not exist, there are " + str(len(self.times)) + " tasks")
+        # a repeated edge is the same precedence, as it is in a digraph
+        _, first = np.unique(edges, axis=0, return_index=True)
+        edges = edges[np.sort(first)]
+        self.succIndptr, self.succIndices = buildCSR(edges[:,0], edges[:,1], len(self.times))
+        self.predIndptr, self.predIndices = buildCSR(edges[:,1], edges[:,0], len(self.times))
+
+    # the line given by task number, as in edges_nodes.txt and the report, the tasks are numbered from 1
+    @classmethod
+    def fromTaskNumbers(cls, taskTimes, edges, names=None):
+        return cls(taskTimes, np.asarray(edges, dtype=np.int64).reshape(-1, 2) - 1, names)
+
+    @classmethod
+    def from_networkx(cls, G_digraph):
+        nodes = list(G_digraph.nodes)
+        nodeIndex = { k: i for i, k in enumerate(nodes) }
+        edges = [ [ nodeIndex[u], nodeIndex[v] ] for u, v in G_digraph.edges ]
+        return cls([ G_digraph.nodes[k].get('weight') for k in nodes ], edges,
+                   [ G_digraph.nodes[k].get('name', str(k)) for k in nodes ], [ str(k) for k in nodes ])
+
+    @property
+    def numTasks(self):
+        return len(self.times)
+
+    @property
+    def numEdges(self):
+        return len(self.succIndices)
+
+    def successors(self, i):
+        return self.succIndices[self.succIndptr[i]:self.succIndptr[i+1]]
+
+    def predecessors(self, i):
+        return self.predIndices[self.predIndptr[i]:self.predIndptr[i+1]]
+
+    # the tasks in topological order, raises ValueError when the precedence has a loop
+    def topologicalOrder(self):
+        succIndptr = self.succIndptr.tolist()
+        succIndices = self.succIndices.tolist()
+        predCount = np.diff(self.predIndptr).tolist()
+        order = [ i for i in range(self.numTasks) if predCount[i] == 0 ]
+        for i in order:    # order grows while it is walked
+            for j in succIndices[succIndptr[i]:succIndptr[i+1]]:
+                predCount[j] -= 1
+                if predCount[j] == 0:
+                    order.append(j)
+        if len(order) != self.numTasks:
+            raise ValueError("The precedence of the tasks has a loop, it is not an assembly line")
+        return order
+
+    def to_networkx(self):
+        import networkx as nx
+        G = nx.DiGraph()
+        G.add_nodes_from(self.ids)
+        nx.set_node_attributes(G, { self.ids[i]: {'name': self.names[i], 'weight': float(self.times[i]),
+                                                  'label': self.ids[i]+"-("+formatTime(self.times[i])+")"} for i in range(self.numTasks) })
+        G.add_edges_from( (self.ids[i], self.ids[j]) for i in range(self.numTasks) for j in self.successors(i).tolist() )
+        return G
+# End of LineModel
+
+# the balanced line, as assigned by assignStations()
+#~  stations - the tasks in each station, as task numbers of the line model
+#~  groups   - the same, with the task ids used in the report, ['1', '2', '5']
+#~  weights  - NumPy array of the total task time of each station
+class BalancedLine:
+    def __init__(self, line, stations, weights):
+        self.stations = stations
+        self.groups = [ [ line.ids[i] for i in tasks ] for tasks in stations ]
+        self.weights = np.asarray(weights, dtype=float)
+
+    @property
+    def numStations(self):
+        return len(self.weights)
+
+    # the balanced line digraph for plotGraph(), one node per station
+    def to_networkx(self):
+        import networkx as nx
+        G_balanced_line = nx.DiGraph()
+        group = { k+1: self.groups[k] for k in range(self.numStations) }
+        G_balanced_line.add_nodes_from(group.keys())
+        G_balanced_line.add_edges_from( (k, k+1) for k in range(1, self.numStations) )
+        nx.set_node_attributes(G_balanced_line, {k: {'label':str(k)+" "+str(group[k])} for k in group.keys()} )
+        
+        nx.set_node_attributes(G_balanced_line, { k+1: {'weight':float(self.weights[k])} for k in range(self.numStations) })
+        nx.set_node_attributes(G_balanced_line, {k: {'group':group[k]} for k in group.keys()} )
+        return G_balanced_line
+# End of BalancedLine
+
+# task time as it would be written in tasktime.txt, 20 rather than 20.0
+def formatTime(t):
+    return str(int(t)) if float(t).is_integer() else str(float(t))
+# End of formatTime()
+
+# function to read the lines of a text input file one at a time, for the streaming loader
+#~Yields (line number, text) for every line that is not blank. Blank lines are only allowed at the end of
+#~the file, a blank line between two entries would shift the task numbers of everything after it.
+def readEntries(fname):
+    with open(fname) as f:
+        blankLine = None
+        for lineNumber, text in enumerate(f, 1):
+            text = text.strip()
+            if not text:
+                blankLine = blankLine or lineNumber
+                continue
+            if blankLine is not None:
+                raise ValueError(fname + ":" + str(blankLine) + ": blank line before the end of the file")
+            yield lineNumber, text
+# End of readEntries()
+
+# function to load a line from the four text files, in one streaming pass over each file
+#~The task times and names go straight into compact arrays, every edge is checked against the number of
+#~tasks as it is read, and the number of names is checked against the number of task times, so a broken
+#~input is reported with the file and line it is on.
+#~Returns the line model and the (workdays, workhours, demand) record
+def loadLineText(workingDir):
+    fname = workingDir + "/" + tasktimes_file
+    taskTimes = array.array('d')
+    for lineNumber, text in readEntries(fname):
+        try:
+            taskTimes.append(float(text))
+        except ValueError:
+            raise ValueError(fname + ":" + str(lineNumber) + ": task time is not a number: " + text)
+    numTasks = len(taskTimes)
 
-    return [taskTimes, taskNames, edges_nodes, worktimeDemand];
-# End of getDataFromFile()
+    fname = workingDir + "/" + taskNames_file
+    taskNames = [ sys.intern(text) for lineNumber, text in readEntries(fname) ]
+    if len(taskNames) != numTasks:
+        raise ValueError(fname + " has " + str(len(taskNames)) + " task names, but " + tasktimes_file + " has " + str(numTasks) + " task times")
+
+    fname = workingDir + "/" + edges_nodes_file
+    edges = array.array('q')
+    for lineNumber, text in readEntries(fname):
+        ends = text.split(',')
+        try:
+            if len(ends) != 2:
+                raise ValueError
+            source, target = int(ends[0]), int(ends[1])
+        except ValueError:
+            raise ValueError(fname + ":" + str(lineNumber) + ": an edge is two task numbers, 'from,to': " + text)
+        if not (1 <= source <= numTasks and 1 <= target <= numTasks):
+            raise ValueError(fname + ":" + str(lineNumber) + ": task number out of range 1.." + str(numTasks) + ": " + text)
+        edges.append(source-1)
+        edges.append(target-1)
+
+    line = LineModel(np.frombuffer(taskTimes, dtype=float), np.frombuffer(edges, dtype=np.int64).reshape(-1, 2), taskNames)
+    return line, readWorktimeDemand(workingDir + "/" + workdays_worktime_annualDemand_file)
+# End of loadLineText()
+
+def readWorktimeDemand(fname):
+    for lineNumber, text in readEntries(fname):
+        fields = text.split(',')
+        try:
+            if len(fields) != 3:
+                raise ValueError
+            return tuple( float(k) for k in fields )
+        except ValueError:
+            raise ValueError(fname + ":" + str(lineNumber) + ": expected 'workdays,workhours,demand': " + text)
+    raise ValueError(fname + " is empty, expected 'workdays,workhours,demand'")
+# End of readWorktimeDemand()
+
+# function to save a line in the compact single file format, line.npz
+#~The file holds the NumPy arrays:
+#~  times           - task times
+#~  edges           - (number of edges, 2) array of task numbers, counted from 0
+#~  names           - task names
+#~  worktime demand - workdays, workhours, demand
+def saveLineNpz(fname, line, worktimeDemand):
+    edges = np.column_stack(( np.repeat(np.arange(line.numTasks), np.diff(line.succIndptr)), line.succIndices ))
+    np.savez(fname, times=line.times, edges=edges, names=np.array(line.names, dtype=str),
+             worktime_demand=np.array(worktimeDemand, dtype=float))
+# End of saveLineNpz()
+
+# function to load a line saved by saveLineNpz()
+#~Returns the line model and the (workdays, workhours, demand) record
+def loadLineNpz(fname):
+    with np.load(fname) as data:
+        times = data['times']
+        edges = data['edges']
+        names = data['names'].tolist()
+        worktimeDemand = tuple(data['worktime_demand'].tolist())
+    if len(names) != len(times):
+        raise ValueError(fname + " has " + str(len(names)) + " task names, but " + str(len(times)) + " task times")
+    if len(worktimeDemand) != 3:
+        raise ValueError(fname + ": expected 'workdays,workhours,demand' in worktime_demand")
+    return LineModel(times, edges, names), worktimeDemand
+# End of loadLineNpz()
+
+# function to load the line in a directory, from line.npz when it is there and no older than the text
+# files, otherwise from the four text files
+def loadLine(workingDir):
+    npzName = workingDir + "/" + line_file
+    if os.path.isfile(npzName):
+        textNames = [ workingDir + "/" + k for k in (tasktimes_file, taskNames_file, edges_nodes_file, workdays_worktime_annualDemand_file) ]
+        if all( os.path.getmtime(k) <= os.path.getmtime(npzName) for k in textNames if os.path.isfile(k) ):
+            return loadLineNpz(npzName)
+    return loadLineText(workingDir)
+# End of loadLine()
 
 # function to draw/plot the graph to a file
 def plotGraph(G, ofname, title):
+    from networkx.drawing.nx_agraph import to_agraph
     G.graph['graph']={'rankdir':'LR'} 
     G.graph['node'] = {'shape':'circle'}
     G.graph['edges'] = {'arrowsize':'2.0'}
@@ -66,13 +359,14 @@ def plotGraph(G, ofname, title):
     G.graph['label'] = title
     G.graph['fontsize'] = 20
     A = to_agraph(G)
-    print(A)
     A.layout('dot')
     A.draw(ofname)
 # End of plotGraph()
 
 # function to show the image file on screen, result validation
 def showImg(fname):
+    import matplotlib.pyplot as myplt
+    import matplotlib.image as mpimg
     img = mpimg.imread(fname)
     imgplot = myplt.imshow(img)
     myplt.axis('off')
@@ -93,6 +387,7 @@ def showImg(fname):
 #~  'output file' - name of the output file to save the figure to
 def plotStackBarChart(varlist):
     # plot the bar graph for the unbalanced line showing idle times and task times
+    import matplotlib.pyplot as myplt
     N = len(varlist['task times'])
 
     ind = np.arange(1,N+1)
@@ -127,8 +422,51 @@ def plotStackBarChart(varlist):
     ax.yaxis.grid(True, which='major')
 
     myplt.savefig(varlist['output file'])
+    myplt.close(fig)
 # End of plotBar() function
 
+# function to check if there is no display to show the images on, e.g. a batch node
+def noDisplay():
+    return sys.platform.startswith('linux') and not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY')
+# End of noDisplay()
+
+# the render workers only write files, they never open a window
+def initRenderWorker():
+    import matplotlib
+    matplotlib.use('Agg')
+# End of initRenderWorker()
+
+#~job: ('graph', line, output file, title) for plotGraph(), where line is a LineModel or a BalancedLine,
+#~     or ('bar', varlist) for plotStackBarChart()
+#~Returns the output file, and the start and duration of the drawing for the profiler
+def renderJob(job):
+    start = time.perf_counter_ns()
+    if job[0] == 'graph':
+        plotGraph(job[1].to_networkx(), job[2], job[3])
+        fname = job[2]
+    else:
+        plotStackBarChart(job[1])
+        fname = job[1]['output file']
+    return fname, start, time.perf_counter_ns() - start, os.getpid()
+# End of renderJob()
+
+# function to draw all the figures concurrently, one process for each figure up to the number of cores
+#~Returns the output files, in the same order as the jobs
+#~parallel: False draws the figures one after the other in this process, e.g. inside a batch worker
+def renderAll(renderJobs, parallel=True):
+    if len(renderJobs) == 0:
+        return []
+    if not parallel:
+        initRenderWorker()
+        results = [ renderJob(job) for job in renderJobs ]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(len(renderJobs), os.cpu_count() or 1), initializer=initRenderWorker) as pool:
+            results = list(pool.map(renderJob, renderJobs))
+    for job, (fname, start, duration, pid) in zip(renderJobs, results):
+        profiler.addEvent(("plotGraph " if job[0] == 'graph' else "plotStackBarChart ") + os.path.basename(fname), start, duration, pid)
+    return [ k[0] for k in results ]
+# End of renderAll()
+
 def writeToTextFile(fname, content):
     try:
         fout = open(fname, 'w')
@@ -141,7 +479,19 @@ def writeToTextFile(fname, content):
     fout.close()
 #~End of writeToTextFile()
 
-def createReport(reportVarList):
+# function to work out the figures of merit for a balanced line
+#~limit: the cycle time the idle times are measured against (takt time, highest task time, ...)
+def balancedLineMetrics(balanced, limit, totalProcessingTime, totalworktime):
+    idle = float(np.sum(limit - balanced.weights))
+    return { 'stations': balanced.numStations,
+             'idle time': idle,
+             'smoothness': float(np.sqrt(np.sum(np.power(limit - balanced.weights, 2)))),
+             'max units': totalworktime/float(balanced.weights.max()),
+             'efficiency': (totalProcessingTime/(idle+totalProcessingTime)) * 100 }
+#~End of balancedLineMetrics()
+
+#~fname: the report file to write
+def createReport(reportVarList, fname):
     # Create a report of the calculations
     takttime = reportVarList['takttime']
     workdays = reportVarList['workdays']
@@ -153,13 +503,13 @@ def createReport(reportVarList):
     G_takt_balanced = reportVarList['G_takt_balanced']
     G_highest_balanced = reportVarList['G_highest_balanced']
 
-    maxTaskTime = max([ G.nodes[k].get('weight') for k in G.nodes ])
+    maxTaskTime = float(G.times.max())
    
-    totalProcessingTime = sum([ G.nodes[k].get('weight') for k in G.nodes ])
-    taktIdle = sum( [ takttime-G.nodes[k].get('weight') for k in G.nodes ] )
-    highestIdle = sum( [ maxTaskTime-G.nodes[k].get('weight') for k in G.nodes ] )
-    smoothnessTakt = np.sqrt( sum([ np.power((takttime-G.nodes[k].get('weight')),2) for k in G.nodes ]) )
-    smoothnessHighest = np.sqrt( sum([ np.power((maxTaskTime-G.nodes[k].get('weight')),2) for k in G.nodes ]) )
+    totalProcessingTime = float(G.times.sum())
+    taktIdle = float(np.sum(takttime - G.times))
+    highestIdle = float(np.sum(maxTaskTime - G.times))
+    smoothnessTakt = np.sqrt( np.sum(np.power(takttime - G.times, 2)) )
+    smoothnessHighest = np.sqrt( np.sum(np.power(maxTaskTime - G.times, 2)) )
     reportStr=list()
     reportStr.append("  Report generated on " + date.today().strftime("%d %B %Y") + " at " + datetime.now().strftime("%H:%M:%S") )
     reportStr.append("  ")
@@ -171,15 +521,15 @@ def createReport(reportVarList):
     reportStr.append( "  The takt time for this process                : "+ "{:12.2f} ".format(takttime) + argsUnit)  
     reportStr.append( "  The highest processing time for this line     : "+ "{:12.2f} ".format(maxTaskTime) + argsUnit)  
     reportStr.append( "  The total task time for this line             : "+ "{:12.2f} ".format(totalProcessingTime) + argsUnit)  
-    reportStr.append( "  Number of nodes                               : "+ "{:12.0f} ".format(len(G.nodes.keys())) )  
-    reportStr.append( "  Number of edges                               : "+ "{:12.0f} ".format(len(G.edges)) )  
+    reportStr.append( "  Number of nodes                               : "+ "{:12.0f} ".format(G.numTasks) )  
+    reportStr.append( "  Number of edges                               : "+ "{:12.0f} ".format(G.numEdges) )  
     reportStr.append(" ")
     reportStr.append(" ")
     reportStr.append("  ----------------------------------------- Unbalanced Line -------------------------------------------------")
     reportStr.append("        task name                                                          task time   idle time   idle time")
     reportStr.append("                                                                                          (takt)   (highest)")
     reportStr.append("  -----------------------------------------------------------------------------------------------------------")
-    res = [ "["+"{0:>3}".format(k)+"] "+"{0:<64}".format(G.nodes[k].get('name'))+"{:12.2f}".format(G.nodes[k].get('weight'))+"{:12.2f}".format(takttime-G.nodes[k].get('weight'))+"{:12.2f}".format(maxTaskTime-G.nodes[k].get('weight')) for k in G.nodes ]
+    res = [ "["+"{0:>3}".format(G.ids[k])+"] "+"{0:<64}".format(G.names[k])+"{:12.2f}".format(G.times[k])+"{:12.2f}".format(takttime-G.times[k])+"{:12.2f}".format(maxTaskTime-G.times[k]) for k in range(G.numTasks) ]
     [ reportStr.append("  " + res[k]) for k in range(0,len(res)) ]
     reportStr.append(" ")
     
@@ -194,49 +544,96 @@ def createReport(reportVarList):
     reportStr.append("  ---------------------------------------- Balanced Line (takt) ---------------------------------------------")
     reportStr.append("        task groupings                                                     task time               idle time")
     reportStr.append("  -----------------------------------------------------------------------------------------------------------")
-    res = [ "["+"{0:>3}".format(k)+"] "+"{0:<64}".format(str(G_takt_balanced.nodes[k].get('group')))+"{:12.2f}".format(G_takt_balanced.nodes[k].get('weight'))+"{:24.2f}".format(takttime-G_takt_balanced.nodes[k].get('weight')) for k in G_takt_balanced.nodes ]
+    res = [ "["+"{0:>3}".format(k+1)+"] "+"{0:<64}".format(str(G_takt_balanced.groups[k]))+"{:12.2f}".format(G_takt_balanced.weights[k])+"{:24.2f}".format(takttime-G_takt_balanced.weights[k]) for k in range(G_takt_balanced.numStations) ]
     takt_res = res
     [ reportStr.append("  " + res[k]) for k in range(0,len(res)) ]
     reportStr.append(" ")
-    global taktBalancedIdle
-    taktBalancedIdle = sum( [ takttime-G_takt_balanced.nodes[k].get('weight') for k in G_takt_balanced.nodes ] )
-    smoothnessTaktBalanced = np.sqrt( sum([ np.power((takttime-G_takt_balanced.nodes[k].get('weight')),2) for k in G_takt_balanced.nodes ]) )
+    taktMetrics = balancedLineMetrics(G_takt_balanced, takttime, totalProcessingTime, totalworktime)
+    taktBalancedIdle = taktMetrics['idle time']
     reportStr.append( "  Total idle time                                 : "+"{:12.2f} ".format(float(taktBalancedIdle)) + argsUnit) 
-    reportStr.append( "  Smoothness index                                : "+"{:12.2f} ".format(smoothnessTaktBalanced) ) 
-    reportStr.append( "  Maximum units with this setup (annual demand)   : "+"{:12.2f} ".format(totalworktime/max([ G_takt_balanced.nodes[k].get('weight') for k in G_takt_balanced.nodes ]) ) )  
-    reportStr.append( "  Line efficiency                                 : "+"{:12.2f} %".format( (totalProcessingTime/(float(taktBalancedIdle)+totalProcessingTime)) * 100 ) ) 
+    reportStr.append( "  Smoothness index                                : "+"{:12.2f} ".format(taktMetrics['smoothness']) ) 
+    reportStr.append( "  Maximum units with this setup (annual demand)   : "+"{:12.2f} ".format(taktMetrics['max units']) )  
+    reportStr.append( "  Line efficiency                                 : "+"{:12.2f} %".format(taktMetrics['efficiency']) ) 
     reportStr.append(" ")
     reportStr.append(" ")
     reportStr.append("  -------------------------------------- Balanced Line (highest) --------------------------------------------")
     reportStr.append("        task groupings                                                     task time               idle time")
     reportStr.append("  -----------------------------------------------------------------------------------------------------------")
-    res = [ "["+"{0:>3}".format(k)+"] "+"{0:<64}".format(str(G_highest_balanced.nodes[k].get('group')))+"{:12.2f}".format(G_highest_balanced.nodes[k].get('weight'))+"{:24.2f}".format(maxTaskTime-G_highest_balanced.nodes[k].get('weight')) for k in G_highest_balanced.nodes ]
+    res = [ "["+"{0:>3}".format(k+1)+"] "+"{0:<64}".format(str(G_highest_balanced.groups[k]))+"{:12.2f}".format(G_highest_balanced.weights[k])+"{:24.2f}".format(maxTaskTime-G_highest_balanced.weights[k]) for k in range(G_highest_balanced.numStations) ]
     [ reportStr.append("  " + res[k]) for k in range(0,len(res)) ]
     reportStr.append(" ")
-    highestBalancedIdle = sum( [ maxTaskTime-G_highest_balanced.nodes[k].get('weight') for k in G_highest_balanced.nodes ] )
-    smoothnessHighestBalanced = np.sqrt( sum([ np.power((maxTaskTime-G_highest_balanced.nodes[k].get('weight')),2) for k in G_highest_balanced.nodes ]) )
-    reportStr.append( "  Total idle time                                 : "+"{:12.2f} ".format(float(highestBalancedIdle)) + argsUnit) 
-    reportStr.append( "  Smoothness index                                : "+"{:12.2f} ".format(smoothnessHighestBalanced) ) 
-    reportStr.append( "  Maximum units with this setup (highest)         : "+"{:12.2f} ".format(totalworktime/max([ G_highest_balanced.nodes[k].get('weight') for k in G_highest_balanced.nodes ]) ) ) 
-    reportStr.append( "  Line efficiency                                 : "+"{:12.2f} %".format( (totalProcessingTime/(float(highestBalancedIdle)+totalProcessingTime)) * 100 ) ) 
+    highestMetrics = balancedLineMetrics(G_highest_balanced, maxTaskTime, totalProcessingTime, totalworktime)
+    reportStr.append( "  Total idle time                                 : "+"{:12.2f} ".format(float(highestMetrics['idle time'])) + argsUnit) 
+    reportStr.append( "  Smoothness index                                : "+"{:12.2f} ".format(highestMetrics['smoothness']) ) 
+    reportStr.append( "  Maximum units with this setup (highest)         : "+"{:12.2f} ".format(highestMetrics['max units']) ) 
+    reportStr.append( "  Line efficiency                                 : "+"{:12.2f} %".format(highestMetrics['efficiency']) ) 
+    if reportVarList.get('G_stations_balanced') is not None:
+        # the minimum cycle time for a fixed number of stations, from calculateMinCycleTime()
+        G_stations_balanced = reportVarList['G_stations_balanced']
+        stationsCycleTime = reportVarList['stations cycletime']
+        reportStr.append(" ")
+        reportStr.append(" ")
+        reportStr.append("  " + "{:-^107}".format(" Balanced Line (" + str(reportVarList['stations']) + " stations) "))
+        reportStr.append("        task groupings                                                     task time               idle time")
+        reportStr.append("  -----------------------------------------------------------------------------------------------------------")
+        res = [ "["+"{0:>3}".format(k+1)+"] "+"{0:<64}".format(str(G_stations_balanced.groups[k]))+"{:12.2f}".format(G_stations_balanced.weights[k])+"{:24.2f}".format(stationsCycleTime-G_stations_balanced.weights[k]) for k in range(G_stations_balanced.numStations) ]
+        [ reportStr.append("  " + res[k]) for k in range(0,len(res)) ]
+        reportStr.append(" ")
+        stationsMetrics = balancedLineMetrics(G_stations_balanced, stationsCycleTime, totalProcessingTime, totalworktime)
+        reportStr.append( "  Minimum cycle time                              : "+"{:12.2f} ".format(stationsCycleTime) + argsUnit) 
+        reportStr.append( "  Total idle time                                 : "+"{:12.2f} ".format(float(stationsMetrics['idle time'])) + argsUnit) 
+        reportStr.append( "  Smoothness index                                : "+"{:12.2f} ".format(stationsMetrics['smoothness']) ) 
+        reportStr.append( "  Maximum units with this setup (stations)        : "+"{:12.2f} ".format(stationsMetrics['max units']) ) 
+        reportStr.append( "  Line efficiency                                 : "+"{:12.2f} %".format(stationsMetrics['efficiency']) ) 
+    for name, limit, G_balanced in ( ('takt', takttime, G_takt_balanced), ('highest', maxTaskTime, G_highest_balanced) ):
+        # the best balancing found by improveBalance(), next to the RPW balancing it started from
+        G_improved = reportVarList.get('G_' + name + '_improved')
+        if G_improved is None:
+            continue
+        reportStr.append(" ")
+        reportStr.append(" ")
+        reportStr.append("  " + "{:-^107}".format(" Improved Line (" + name + ", " + "{:g}".format(reportVarList['improve seconds']) + " s search) "))
+        reportStr.append("        task groupings                                                     task time               idle time")
+        reportStr.append("  -----------------------------------------------------------------------------------------------------------")
+        res = [ "["+"{0:>3}".format(k+1)+"] "+"{0:<64}".format(str(G_improved.groups[k]))+"{:12.2f}".format(G_improved.weights[k])+"{:24.2f}".format(limit-G_improved.weights[k]) for k in range(G_improved.numStations) ]
+        [ reportStr.append("  " + res[k]) for k in range(0,len(res)) ]
+        reportStr.append(" ")
+        baselineMetrics = balancedLineMetrics(G_balanced, limit, totalProcessingTime, totalworktime)
+        improvedMetrics = balancedLineMetrics(G_improved, limit, totalProcessingTime, totalworktime)
+        reportStr.append( "{:>64} {:>12}".format("RPW", "improved") )
+        reportStr.append( "  Number of stations                              : "+"{:12d} {:12d}".format(baselineMetrics['stations'], improvedMetrics['stations']) ) 
+        reportStr.append( "  Total idle time                                 : "+"{:12.2f} {:12.2f} ".format(baselineMetrics['idle time'], improvedMetrics['idle time']) + argsUnit) 
+        reportStr.append( "  Smoothness index                                : "+"{:12.2f} {:12.2f} ".format(baselineMetrics['smoothness'], improvedMetrics['smoothness']) ) 
+        reportStr.append( "  Maximum units with this setup                   : "+"{:12.2f} {:12.2f} ".format(baselineMetrics['max units'], improvedMetrics['max units']) ) 
+        reportStr.append( "  Line efficiency                                 : "+"{:12.2f} {:12.2f} %".format(baselineMetrics['efficiency'], improvedMetrics['efficiency']) ) 
+    simulation = reportVarList.get('simulation')
+    for name, (G_balanced, buffers, sim) in (reportVarList.get('simulated') or {}).items():
+        # the Monte Carlo throughput from simulateLine(), next to the deterministic maximum units
+        title = name + ", " + str(sim['replications']) + " x " + str(sim['units']) + " units"
+        reportStr.append(" ")
+        reportStr.append(" ")
+        reportStr.append("  " + "{:-^107}".format(" Simulated Line (" + title + ") "))
+        reportStr.append("        task groupings                                                     task time         utilization (%)")
+        reportStr.append("  -----------------------------------------------------------------------------------------------------------")
+        res = [ "["+"{0:>3}".format(k+1)+"] "+"{0:<64}".format(str(G_balanced.groups[k]))+"{:12.2f}".format(G_balanced.weights[k])+"{:24.2f}".format(sim['utilization'][k]*100) for k in range(G_balanced.numStations) ]
+        [ reportStr.append("  " + res[k]) for k in range(0,len(res)) ]
+        reportStr.append(" ")
+        low, high = sim['throughput ci']
+        reportStr.append( "  Task times                                      : " + simulation['task times'] )
+        reportStr.append( "  Buffers after each station                      : " + ("no limit" if buffers is None else ",".join( str(k) for k in buffers )) )
+        reportStr.append( "  Throughput                                      : "+"{:12.6f} units/".format(sim['throughput']) + argsUnit )
+        reportStr.append( "  Throughput 95% confidence interval              : "+"{:12.6f} {:12.6f} units/".format(low, high) + argsUnit )
+        reportStr.append( "  Expected units with this setup                  : "+"{:12.2f} ".format(sim['throughput']*totalworktime) )
+        reportStr.append( "  Expected units 95% confidence interval          : "+"{:12.2f} {:12.2f} ".format(low*totalworktime, high*totalworktime) )
+        reportStr.append( "  Maximum units with this setup (deterministic)   : "+"{:12.2f} ".format(totalworktime/float(G_balanced.weights.max())) )
     reportStr.append("  \n  ")
     reportStr.append("  Report generated by " + scriptName + " v" + scriptVersion)
     reportStr.append("  End of report ")
 
-    writeToTextFile( workingDir + "/" + "Line_Balancing_Report.txt", reportStr )
+    writeToTextFile( fname, reportStr )
 #~End of createReport()
 
 def cmdLineArgs(argv):
-    global scriptName
-    global scriptVersion
-    
-    scriptName = os.path.realpath(__file__)
-    #print (sys.argv)
-    with open(scriptName) as fname:
-        for line in fname:
-            results = re.search('.*version: ([0-9][.][0-9][0-9]).*', line, re.M|re.I)
-            if results:
-                scriptVersion = str(results.group(1))
     parser = argparse.ArgumentParser( 
                 description="Program to determine the order for a Balanced Line using Ranked Positional Weight Method", 
                 epilog = "Ranked Positional Weight Method v" + scriptVersion + " This is where you can add more information."
@@ -252,90 +649,1193 @@ def cmdLineArgs(argv):
             help="Specifies the base unit for calculations. " + 
                   "Values to use 'hrs'=hours, 'min'=minutes and 'sec'=seconds"
                         )
+    parser.add_argument(  
+            "--sweep", 
+            default=None,
+            help="Sweep mode, balance the line for a list of cycle times (e.g. 40,50,60) or a range " +
+                  "start:stop:step (e.g. 40:80:5), in the base unit, and write a table of the results."
+                        )
+    parser.add_argument(  
+            "--sweep-demand", 
+            default=None,
+            help="Sweep mode, as --sweep but the list or range is the annual demand, the cycle time " +
+                  "for each demand is worked out from demand_worktime.txt."
+                        )
+    parser.add_argument(  
+            "-s", "--stations", 
+            type=int,
+            default=None,
+            help="Also balance the line for a fixed number of stations, finding the minimum cycle time " +
+                  "that fits the tasks into that many stations."
+                        )
+    parser.add_argument(  
+            "--headless", 
+            action="store_true",
+            help="Never open a window to show the figures, they are still saved to files. " +
+                  "This is the default on linux when there is no display."
+                        )
+    parser.add_argument(  
+            "--no-render", 
+            action="store_true",
+            help="Do not draw any figures, only the report is produced."
+                        )
+    parser.add_argument(  
+            "--batch", 
+            default=None,
+            help="Batch mode, balance every line directory under this root directory, or matching this glob " +
+                  "pattern, in a pool of worker processes. A summary of all the lines is written to " +
+                  "Line_Balancing_Summary.csv and Line_Balancing_Summary.json."
+                        )
+    parser.add_argument(  
+            "--summary-dir", 
+            default=None,
+            help="Directory for the batch summary files, defaults to the batch root directory, or the " +
+                  "current directory for a glob pattern."
+                        )
+    parser.add_argument(  
+            "-j", "--jobs", 
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes in batch mode, defaults to the number of cores."
+                        )
+    parser.add_argument(  
+            "--cache-dir", 
+            default=os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser("~/.cache")), "rpw"),
+            help="Directory of the result cache. A line whose inputs have not changed reuses its balancing " +
+                  "and figures from the cache, only the report is written again."
+                        )
+    parser.add_argument(  
+            "--cache-size", 
+            type=float,
+            default=256,
+            help="Size limit of the result cache in MB, the least recently used lines are removed first."
+                        )
+    parser.add_argument(  
+            "--no-cache", 
+            action="store_true",
+            help="Do not read or write the result cache."
+                        )
+    parser.add_argument(  
+            "--convert", 
+            action="store_true",
+            help="Convert the four text files in the directory to the single file format, line.npz, and exit. " +
+                  "A line.npz that is newer than the text files is read instead of them."
+                        )
+    parser.add_argument(  
+            "--profile", 
+            action="store_true",
+            help="Time each stage of the run and write the timings to Line_Balancing_Profile.json, and a " +
+                  "Chrome trace (chrome://tracing) to Line_Balancing_Trace.json, in the line directory."
+                        )
+    parser.add_argument(  
+            "--improve", 
+            type=float,
+            default=None,
+            metavar="SECONDS",
+            help="Search for a better balancing than the RPW one, fewer stations or a lower smoothness index, for " +
+                  "this many seconds in -j worker processes. The report shows both, side by side."
+                        )
+    parser.add_argument(  
+            "--simulate", 
+            type=int,
+            default=None,
+            metavar="UNITS",
+            help="Simulate the balanced lines with varying task times, UNITS units in each of --replications runs, " +
+                  "and report the expected throughput, its 95%% confidence interval and the utilization of each station."
+                        )
+    parser.add_argument(  
+            "--replications", 
+            type=int,
+            default=1000,
+            help="Number of replications of the simulation."
+                        )
+    parser.add_argument(  
+            "--dist", 
+            default="lognormal",
+            choices=simulationFamilies,
+            help="Task time distribution of the simulation, its mean is the task time. Each task can have its own " +
+                  "in " + taskdist_file + ", one 'family' or 'family,cv' line per task."
+                        )
+    parser.add_argument(  
+            "--cv", 
+            type=float,
+            default=0.2,
+            help="Coefficient of variation (standard deviation / mean) of the task times in the simulation."
+                        )
+    parser.add_argument(  
+            "--buffers", 
+            default=None,
+            help="Buffer sizes after the stations in the simulation, one value for all of them or a comma separated " +
+                  "list (the last value is used for the rest of the stations). No limit by default."
+                        )
+    parser.add_argument(  
+            "--warmup", 
+            type=float,
+            default=0.1,
+            help="Fraction of the units of each replication left out of the simulated figures, while the line fills up."
+                        )
+    parser.add_argument(  
+            "--seed", 
+            type=int,
+            default=None,
+            help="Seed of the simulation, for figures that can be repeated."
+                        )
+    parser.add_argument(  
+            "--incremental", 
+            action="store_true",
+            help="Keep the positional weights and the stations in " + incremental_file + " in the line directory, " +
+                  "so after a change of task times or added edges only what the change affects is worked out again."
+                        )
+    parser.add_argument(  
+            "--serve", 
+            default=None,
+            help="Run as a balancing service on [host:]port (e.g. 8765 or 0.0.0.0:8765), answering JSON queries over " +
+                  "HTTP. The lines in --batch, or the line in -d, are kept in memory and balanced by -j worker processes."
+                        )
     return parser.parse_args() 
 #~End of cmdLineArgs()
 
-def calculateRPW(G_digraph, limit):
-    rpw_weights = { i : sum([ G_digraph.nodes[j].get('weight') for j in list(nx.dfs_tree(G_digraph, source=i)) ]) for i in G_digraph.nodes }
-    sorted_rpw_weights = \
-            { k:v for k, v in sorted(rpw_weights.items(), key=lambda item: item[1], reverse=True) }
-    sorted_rpw_weights_keys = list(sorted_rpw_weights.keys())    
-    
-    print(rpw_weights)
-    print(sorted_rpw_weights)
-    print(limit)
+# function to turn a sweep argument into a list of values
+#~text: either a comma separated list "40,50,60" or a range "start:stop:step", the stop value is included
+def parseSweepValues(text):
+    if ':' in text:
+        start, stop, step = [ float(k) for k in text.split(':') ]
+        if step <= 0:
+            raise ValueError("The step for the sweep range must be positive: " + text)
+        return list(np.arange(start, stop + step/2, step))
+    return [ float(k) for k in text.split(',') if k.strip() ]
+#~End of parseSweepValues()
+
+# function to turn the --buffers argument into the buffer after each station of a line but the last
+#~text: one value for all the stations, or a comma separated list, the last value is used for the rest of the stations
+#~Returns None when the buffers have no limit
+def parseBuffers(text, numStations):
+    if text is None:
+        return None
+    try:
+        values = [ int(k) for k in text.split(',') if k.strip() ]
+        if not values or min(values) < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("The buffers must be whole numbers of 0 or more: " + text)
+    return (values + values[-1:] * numStations)[:numStations-1]
+#~End of parseBuffers()
+
+# function to calculate the positional weight of every task in a single pass
+#~The line is walked once in reverse topological order. Each task keeps the set of tasks reachable from
+#~it (itself included) as a bitset, held in a python int, so a successor shared by several paths is only
+#~counted once. The positional weight is the sum of the task time of every task in that set, this gives
+#~the same result as summing the task time over nx.dfs_tree() for each node, without building a tree
+#~for every node.
+#~Returns an array of the positional weights, indexed by task.
+def calculatePositionalWeights(line):
+    rpw_weights = weightsFromReachable(line, calculateReachable(line))
+    profiler.count("calculatePositionalWeights passes")
+    profiler.count("calculatePositionalWeights tasks", line.numTasks)
+    return rpw_weights
+#~End of calculatePositionalWeights
+
+# function to work out the set of tasks reachable from each task, itself included, as python int bitsets
+def calculateReachable(line):
+    succIndptr = line.succIndptr.tolist()
+    succIndices = line.succIndices.tolist()
+
+    reachable = [0] * line.numTasks
+    for i in reversed(line.topologicalOrder()):
+        bits = 1 << i
+        for j in succIndices[succIndptr[i]:succIndptr[i+1]]:
+            bits |= reachable[j]
+        reachable[i] = bits
+    return reachable
+#~End of calculateReachable
+
+# function to sum the task times over the reachable bitsets, for every task or only for the tasks given
+#~The task times are summed as whole numbers of their decimalScale(), so each positional weight is the exact sum
+#~rounded once, whatever order the tasks are added in. That is what lets IncrementalBalancer update a positional
+#~weight by adding a change and still get exactly the weight worked out here.
+def weightsFromReachable(line, reachable, tasks=None, rpw_weights=None):
+    scale = decimalScale(line.times)
+    if scale is None:
+        return reachableSums(line.times, reachable, tasks, rpw_weights)
+    sums = reachableSums(scaledTimes(line.times, scale), reachable, tasks)
+    if rpw_weights is None:
+        return sums / scale
+    rpw_weights[tasks] = sums[tasks] / scale
+    return rpw_weights
+#~End of weightsFromReachable
+
+# function to sum the values over the reachable bitsets, for every task or only for the tasks given
+#~The bitsets are summed a byte at a time, from a table of the sums of the 8 tasks of each byte for all 256
+#~patterns of them, over the bytes from the lowest to the highest reachable task only. This is one table look up
+#~per 8 tasks rather than unpacking every bit, but the sets of a long line still span most of it, so the cost is
+#~quadratic in the number of tasks in the worst case (N*N/8 look ups), with a small constant.
+def reachableSums(values, reachable, tasks=None, sums=None):
+    numTasks = len(values)
+    if sums is None:
+        sums = np.zeros(numTasks, dtype=values.dtype)
+    numBytes = (numTasks + 7) // 8
+    padded = np.zeros(numBytes * 8, dtype=values.dtype)
+    padded[:numTasks] = values
+    patterns = (np.arange(256)[:, None] >> np.arange(8)) & 1
+    byteSums = (padded.reshape(numBytes, 8) @ patterns.T.astype(values.dtype)).ravel()
+    byteOffsets = np.arange(numBytes) * 256
+
+    for i in (range(numTasks) if tasks is None else tasks):
+        bits = reachable[i]
+        first = ((bits & -bits).bit_length() - 1) // 8
+        last = (bits.bit_length() + 7) // 8
+        setBytes = np.frombuffer((bits >> (8 * first)).to_bytes(last - first, 'little'), dtype=np.uint8)
+        sums[i] = byteSums[byteOffsets[first:last] + setBytes].sum()
+    return sums
+#~End of reachableSums
+
+# function to find the power of ten that turns every task time into a whole number, up to 6 decimals
+#~Returns the scale, or None when the task times have more decimals, or their sum is too large to be exact
+def decimalScale(times):
+    for decimals in range(7):
+        scale = 10**decimals
+        scaled = np.round(times * scale)
+        if np.all(scaled / scale == times):
+            return scale if float(np.abs(scaled).sum()) < 2**53 else None
+    return None
+#~End of decimalScale
+
+# the task times as whole numbers of scale, see decimalScale()
+def scaledTimes(times, scale):
+    return np.round(times * scale).astype(np.int64)
+#~End of scaledTimes
+
+# function to turn a bitset of tasks into a boolean mask over the tasks
+def bitsetMask(bits, numTasks):
+    return np.unpackbits(np.frombuffer(bits.to_bytes((numTasks + 7) // 8, 'little'), dtype=np.uint8), count=numTasks, bitorder='little').astype(bool)
+#~End of bitsetMask
+
+# function to rank the tasks by their positional weight, highest first, ties keep the task order
+#~Returns the tasks in rank order
+def rankNodes(rpw_weights):
+    return np.argsort(-np.asarray(rpw_weights), kind='stable')
+#~End of rankNodes
+
+# function to assign the tasks to stations, in accordance to the ranked positional weights
+#~Tasks become ready once all their predecessors (edges from edges_nodes.txt) have been assigned, and each
+#~station is filled with the highest ranked ready task that still fits within limit. A task longer than
+#~limit gets a station of its own.
+#~The ready tasks are kept in a tournament tree laid out in rank order, each inner node holding the shortest
+#~task time below it. The highest ranked task that fits is found by walking down from the root, always to
+#~the left when the left side has a task that fits, so each pick costs O(log N) however many ready tasks
+#~are too long for what is left of the station.
+#~Returns the balanced line, see BalancedLine.
+#~rankedTasks: the tasks ranked by rankNodes(), pass them in to reuse the ranking across calls.
+#~keepStations: the first stations of an earlier assignment to carry on from, rather than starting from an empty
+#~              line, see IncrementalBalancer
+#~readyStep: a list that is filled with the step (number of tasks assigned so far) at which each task became
+#~           ready, the entries for the tasks ready when carrying on from keepStations are kept as they are
+def assignStations(line, rpw_weights, limit, rankedTasks=None, keepStations=None, readyStep=None):
+    if rankedTasks is None:
+        rankedTasks = rankNodes(rpw_weights)
+    rankedTasks = rankedTasks.tolist()
+    rank = [0] * line.numTasks
+    for r, i in enumerate(rankedTasks):
+        rank[i] = r
+    taskTimes = line.times.tolist()
+    succIndptr = line.succIndptr.tolist()
+    succIndices = line.succIndices.tolist()
+    predCount = np.diff(line.predIndptr).tolist()
+
+    size = 1
+    while size < line.numTasks:
+        size *= 2
+    notReady = float('inf')
+    ready = [notReady] * (2*size)
+    def setReady(r, value):
+        pos = r + size
+        ready[pos] = value
+        pos >>= 1
+        while pos:
+            ready[pos] = min(ready[2*pos], ready[2*pos+1])
+            pos >>= 1
 
-    count=0;totalweight=0;group={};group_key=1;tmpgrp=list();nodeweight=list(); 
-    for count in range(len(sorted_rpw_weights_keys)):
-        totalweight += G_digraph.nodes[sorted_rpw_weights_keys[count]].get('weight')
-        tmpgrp += [sorted_rpw_weights_keys[count]]
-        print("Adding " + sorted_rpw_weights_keys[count] + " to group " + str(group_key))
-        print(tmpgrp)
-        print("Total weight now: " + str(totalweight))
-        if (count+1 > len(sorted_rpw_weights_keys)-1):
-            group[group_key] = tmpgrp
+    totalweight=0;stations=list();tmpgrp=list();nodeweight=list();
+    assigned = [False] * line.numTasks
+    for tasks in (keepStations or []):
+        weight = 0
+        for picked in tasks:
+            assigned[picked] = True
+            weight += taskTimes[picked]
+            for j in succIndices[succIndptr[picked]:succIndptr[picked+1]]:
+                predCount[j] -= 1
+        stations.append(list(tasks))
+        nodeweight.append(weight)
+    startStep = sum( len(k) for k in stations )
+
+    for i in range(line.numTasks):
+        if predCount[i] == 0 and not assigned[i]:
+            ready[rank[i] + size] = taskTimes[i]
+            if readyStep is not None and startStep == 0:
+                readyStep[i] = 0
+    for pos in range(size-1, 0, -1):
+        ready[pos] = min(ready[2*pos], ready[2*pos+1])
+
+    for count in range(startStep, line.numTasks):
+        if ready[1] == notReady:
+            raise ValueError("The precedence of the tasks has a loop, it is not an assembly line")
+        if tmpgrp and not totalweight + ready[1] <= limit:
+            # nothing that is ready fits in this station, close it and start the next one
+            stations.append(tmpgrp)
             nodeweight.append(totalweight)
-            break
-        if (totalweight + G_digraph.nodes[sorted_rpw_weights_keys[count+1]].get('weight')) > limit:
-            group[group_key] = tmpgrp
             tmpgrp = []
-            group_key += 1
-            nodeweight.append(totalweight)
             totalweight = 0
+
+        pos = 1
+        while pos < size:
+            if tmpgrp:
+                pos = 2*pos if totalweight + ready[2*pos] <= limit else 2*pos+1
+            else:
+                # an empty station takes the highest ranked ready task, even when it is longer than limit
+                pos = 2*pos if ready[2*pos] != notReady else 2*pos+1
+        picked = rankedTasks[pos - size]
+        setReady(pos - size, notReady)
+
+        tmpgrp.append(picked)
+        totalweight += taskTimes[picked]
+        for j in succIndices[succIndptr[picked]:succIndptr[picked+1]]:
+            predCount[j] -= 1
+            if predCount[j] == 0:
+                setReady(rank[j], taskTimes[j])
+                if readyStep is not None:
+                    readyStep[j] = count + 1
+
+    if tmpgrp:
+        stations.append(tmpgrp)
+        nodeweight.append(totalweight)
+    profiler.count("assignStations passes")
+    profiler.count("assignStations tasks assigned", line.numTasks - startStep)
+    profiler.count("assignStations stations opened", len(stations))
+    return BalancedLine(line, stations, nodeweight)
+#~End of assignStations
+
+# function to balance the line against many limits at once
+#~The positional weights and the ranking of the tasks are worked out once and shared, and assignStations() is run
+#~for every limit, each run costs O(N log N) with its tournament tree.
+#~Returns a dictionary of arrays, one entry per limit:
+#~  'limit'      - the limit (cycle time) used
+#~  'stations'   - number of stations needed
+#~  'idle time'  - total idle time over all the stations
+#~  'overrun'    - total time the stations take over the limit, only when the limit is below the longest task
+#~  'feasible'   - whether the line can run at the limit at all, no task is longer than the limit
+#~  'smoothness' - smoothness index against the limit
+#~  'efficiency' - line efficiency in %
+def sweepStations(line, rpw_weights, limits):
+    rankedTasks = rankNodes(rpw_weights)
+    limits = np.asarray(limits, dtype=float)
+    stations = np.zeros(len(limits), dtype=np.int64)
+    sumSquares = np.zeros(len(limits))
+    idle = np.zeros(len(limits))
+    overrun = np.zeros(len(limits))
+    for k, limit in enumerate(limits):
+        balanced = assignStations(line, rpw_weights, limit, rankedTasks)
+        stations[k] = balanced.numStations
+        sumSquares[k] = np.sum(np.power(limit - balanced.weights, 2))
+        # a task longer than the limit gets a station of its own, which runs over the limit rather than idling
+        idle[k] = np.sum(np.maximum(limit - balanced.weights, 0))
+        overrun[k] = np.sum(np.maximum(balanced.weights - limit, 0))
+
+    totalProcessingTime = float(line.times.sum())
+    return { 'limit': limits,
+             'stations': stations,
+             'idle time': idle,
+             'overrun': overrun,
+             'feasible': limits >= line.times.max(),
+             'smoothness': np.sqrt(sumSquares),
+             'efficiency': (totalProcessingTime/(idle+totalProcessingTime)) * 100 }
+#~End of sweepStations
+
+def writeSweepTable(fname, sweep, totalworktime, argsUnit):
+    header = [ "cycle time (" + argsUnit + ")", "demand (units)", "stations", "idle time (" + argsUnit + ")", "overrun (" + argsUnit + ")",
+               "smoothness index", "line efficiency (%)", "feasible" ]
+    rows = [ [ "{:.4f}".format(sweep['limit'][k]), "{:.2f}".format(totalworktime/sweep['limit'][k]), str(sweep['stations'][k]),
+               "{:.4f}".format(sweep['idle time'][k]), "{:.4f}".format(sweep['overrun'][k]), "{:.4f}".format(sweep['smoothness'][k]),
+               "{:.2f}".format(sweep['efficiency'][k]), "yes" if sweep['feasible'][k] else "no" ]
+             for k in range(len(sweep['limit'])) ]
+    with open(fname, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+    print("  {:>14} {:>14} {:>9} {:>14} {:>14} {:>12} {:>12} {:>9}".format("cycle time", "demand", "stations", "idle time", "overrun", "smoothness", "efficiency", "feasible"))
+    [ print("  {:>14} {:>14} {:>9} {:>14} {:>14} {:>12} {:>11}% {:>9}".format(*row)) for row in rows ]
+    if not all(sweep['feasible']):
+        print("  A cycle time below the longest task cannot be met, those lines are marked as not feasible")
+#~End of writeSweepTable()
+
+# function to find the minimum cycle time for a fixed number of stations (SALBP-2)
+#~The cycle time is searched by bisection between the lower bound, max(highest task time, total task time/
+#~stations), and the total task time, where one station is always enough. Each probe is one assignStations()
+#~pass with the same ranking, and a feasible probe tightens the upper bound down to its busiest station.
+#~When the task times have a decimalScale() the station times are whole multiples of 1/scale too, so the search
+#~is over those multiples and stops at a gap of one, each probe half way between two of them so the rounding of
+#~the station sums cannot tip a station over. Otherwise the search stops at a small tolerance of the total task
+#~time.
+#~Returns the cycle time found and the balanced line for it.
+def calculateMinCycleTime(line, stations, rpw_weights=None):
+    if stations < 1:
+        raise ValueError("The number of stations must be at least 1, got " + str(stations))
+    if rpw_weights is None:
+        rpw_weights = calculatePositionalWeights(line)
+    rankedTasks = rankNodes(rpw_weights)
+    scale = decimalScale(line.times)
+    if scale is None:
+        return minCycleTimeTolerance(line, stations, rpw_weights, rankedTasks)
+
+    scaled = scaledTimes(line.times, scale)
+    probe = lambda k: assignStations(line, rpw_weights, (k + 0.5)/scale, rankedTasks)
+    cycleTime = lambda balanced: int(np.round(balanced.weights.max()*scale))
+
+    lower = max( int(scaled.max()), -(-int(scaled.sum()) // stations) )
+    best = probe(lower)
+    if best.numStations <= stations:
+        return cycleTime(best)/scale, best
+
+    # lower is infeasible from here on, upper is always feasible
+    upper = int(scaled.sum())
+    best = probe(upper)
+    while upper - lower > 1:
+        balanced = probe((lower + upper) // 2)
+        if balanced.numStations <= stations:
+            upper = cycleTime(balanced)
+            best = balanced
+        else:
+            lower = (lower + upper) // 2
+    return upper/scale, best
+#~End of calculateMinCycleTime
+
+# the bisection of calculateMinCycleTime() for task times with no decimalScale(), down to a tolerance
+def minCycleTimeTolerance(line, stations, rpw_weights, rankedTasks):
+    totalProcessingTime = float(line.times.sum())
+    tolerance = max(totalProcessingTime*1e-9, 1e-12)
+
+    lower = max( float(line.times.max()), totalProcessingTime/stations )
+    best = assignStations(line, rpw_weights, lower, rankedTasks)
+    if best.numStations <= stations:
+        return float(best.weights.max()), best
+
+    # lower is infeasible from here on, upper is always feasible, with some room for rounding in the sums
+    upper = totalProcessingTime + tolerance
+    best = assignStations(line, rpw_weights, upper, rankedTasks)
+    while upper - lower > tolerance:
+        probe = (lower + upper)/2
+        balanced = assignStations(line, rpw_weights, probe, rankedTasks)
+        if balanced.numStations <= stations:
+            upper = float(balanced.weights.max())
+            best = balanced
+        else:
+            lower = probe
+    return float(best.weights.max()), best
+#~End of minCycleTimeTolerance
+
+#~line: the line model, a networkx digraph with 'weight' (and 'name') node attributes is also accepted
+#~rpw_weights: the positional weights from calculatePositionalWeights(), pass them in when balancing the same
+#~             line against more than one limit so they are only calculated once.
+def calculateRPW(line, limit, rpw_weights=None):
+    profiler.count("calculateRPW calls")
+    if not isinstance(line, LineModel):
+        line = LineModel.from_networkx(line)
+    if rpw_weights is None:
+        with profiler.stage("calculatePositionalWeights"):
+            rpw_weights = calculatePositionalWeights(line)
     
-    reverse_sorted_task_times = sorted( { i: G_digraph.nodes[i].get('weight') for i in G_digraph.nodes }.items(), key=lambda kv:(kv[1],kv[0]), reverse=True )
-    G_balanced_line = nx.DiGraph()
-    str1 = ", "
-    G_balanced_line.add_nodes_from({ k: (str1.join(group[k])) for k in range(1, len(group)+1) })
-    G_balanced_line.add_edges_from({ k: (k,k+1) for k in range(1,len(group)+1) if (k+1 < len(group)+1) }.values())
-    nx.set_node_attributes(G_balanced_line, {k: {'label':str(k)+" "+str(group[k])} for k in group.keys()} )
-    
-    nx.set_node_attributes(G_balanced_line, { k+1: {'weight':nodeweight[k]} for k in range(0,len(nodeweight)) })
-    nx.set_node_attributes(G_balanced_line, {k: {'group':group[k]} for k in group.keys()} )
-    return G_balanced_line
+    print(rpw_weights)
+    print(limit)
+
+    with profiler.stage("assignStations"):
+        return assignStations(line, rpw_weights, limit)
 #~End of calculateRPW
 
-def main(argv):
-    global workingDir
-    global G
-    global G_takt_balanced
-    global G_highest_balanced
-    args = cmdLineArgs(argv) 
-    workingDir = args.dir 
+# improvement search on top of the ranked positional weight balancing
+#~The RPW balancing is one greedy pass, improveBalance() looks for a balancing with fewer stations, or the same
+#~number of stations and a lower smoothness index, within a time budget. Each worker process starts from the RPW
+#~stations and then restarts from randomized priority rules (positional weight, task time or number of following
+#~tasks, each with random noise), and every start is improved by a local search that moves single tasks and swaps
+#~pairs of tasks between stations. A task can only move to a station between the last station of its predecessors
+#~and the first station of its successors, and only when it fits within the limit, so every balancing found keeps
+#~the precedence and the limit.
 
-    print( " [~ " + str(time.strftime("%Y %b %d-%H:%M:%S")) + " Starting " + scriptName + " v"+ scriptVersion +"]" ) 
-    
-    taskTimes, taskNames, edges_nodes, worktimeDemand = getDataFromFiles(workingDir)
+# the objective of the improvement search, fewer stations first, then the lower smoothness index
+def improveScore(weights, limit):
+    return (len(weights), float(np.sum(np.power(limit - np.asarray(weights, dtype=float), 2))))
+# End of improveScore()
+
+# function to improve one balancing by moving and swapping tasks between stations
+#~stationOf: the station of each task, changed in place
+#~Each round first tries to empty the lightest station, moving all of its tasks to other stations, which removes
+#~the station. Then the tasks are tried in a random order: a task is moved when that makes the station loads more
+#~even (the sum of the squared loads goes down), or empties its station, and failing that it is swapped with a task
+#~of the station before or after when that makes the two loads more even. The search stops after a round without
+#~a change, or at the deadline.
+#~Returns the stations, as lists of tasks in precedence order
+def improveSearch(line, limit, stationOf, rng, deadline, succ, pred, topoPos):
+    taskTimes = line.times.tolist()
+    numStations = max(stationOf) + 1
+    members = [ set() for k in range(numStations) ]
+    loads = [0.0] * numStations
+    for i, k in enumerate(stationOf):
+        members[k].add(i)
+        loads[k] += taskTimes[i]
+
+    # the stations task i can go to, between its predecessors and its successors
+    def window(i):
+        lo = max( [ stationOf[p] for p in pred[i] ], default=0 )
+        hi = min( [ stationOf[q] for q in succ[i] ], default=len(loads)-1 )
+        return lo, hi
+
+    def move(i, k):
+        members[stationOf[i]].remove(i)
+        loads[stationOf[i]] -= taskTimes[i]
+        members[k].add(i)
+        loads[k] += taskTimes[i]
+        stationOf[i] = k
+
+    # an empty station is removed, the stations after it move up by one
+    def removeStation(c):
+        del members[c]
+        del loads[c]
+        for tasks in members[c:]:
+            for j in tasks:
+                stationOf[j] -= 1
+
+    # the best fitting station for task i, the fullest one it fits in
+    def bestFit(i, condition):
+        lo, hi = window(i)
+        target = -1
+        for k in range(lo, hi+1):
+            if k != stationOf[i] and loads[k] + taskTimes[i] <= limit and condition(k):
+                if target < 0 or loads[k] > loads[target]:
+                    target = k
+        return target
+
+    changed = True
+    while changed and time.perf_counter() < deadline:
+        changed = False
+
+        # empty the lightest station, its tasks go in precedence order, later ones first so their successors move out
+        # of the way before them
+        c = int(np.argmin(loads))
+        moved = list()
+        for i in sorted(members[c], key=lambda k: -topoPos[k]):
+            target = bestFit(i, lambda k: True)
+            if target < 0:
+                break
+            moved.append( (i, c) )
+            move(i, target)
+        if not members[c]:
+            removeStation(c)
+            changed = True
+        else:
+            for i, k in reversed(moved):
+                move(i, k)
+
+        for i in rng.permutation(line.numTasks).tolist():
+            if time.perf_counter() >= deadline:
+                break
+            c = stationOf[i]
+            t = taskTimes[i]
+            target = bestFit(i, lambda k: len(members[c]) == 1 or loads[k] + t < loads[c])
+            if target >= 0:
+                move(i, target)
+                if not members[c]:
+                    removeStation(c)
+                changed = True
+                continue
+            lo, hi = window(i)
+            for k in (c-1, c+1):
+                if not lo <= k <= hi:
+                    continue
+                for j in list(members[k]):
+                    u = taskTimes[j]
+                    if not abs((loads[c] - t + u) - (loads[k] + t - u)) < abs(loads[c] - loads[k]):
+                        continue
+                    if loads[c] - t + u > limit or loads[k] - u + t > limit:
+                        continue
+                    stationOf[i], stationOf[j] = k, c    # the windows are checked with both tasks in place
+                    loI, hiI = window(i)
+                    loJ, hiJ = window(j)
+                    stationOf[i], stationOf[j] = c, k
+                    if loI <= k <= hiI and loJ <= c <= hiJ:
+                        move(i, k)
+                        move(j, c)
+                        changed = True
+                        break
+                if stationOf[i] != c:
+                    break
+
+    return [ sorted(tasks, key=lambda k: topoPos[k]) for tasks in members ]
+# End of improveSearch()
+
+# one worker of the improvement search, runs restarts until the deadline
+#~Returns the best stations found and their score
+def improveWorker(line, limit, baseline, rpw_weights, seconds, seed):
+    deadline = time.perf_counter() + seconds
+    rng = np.random.default_rng(seed)
+    succ = [ line.successors(i).tolist() for i in range(line.numTasks) ]
+    pred = [ line.predecessors(i).tolist() for i in range(line.numTasks) ]
+    followers = np.array([ bin(k).count('1') for k in calculateReachable(line) ], dtype=float)
+    topoPos = [0] * line.numTasks
+    for position, i in enumerate(line.topologicalOrder()):
+        topoPos[i] = position
+    rules = [ np.asarray(rpw_weights, dtype=float), line.times, followers ]
+
+    best, bestScore = None, None
+    stations = baseline
+    while True:
+        stationOf = [0] * line.numTasks
+        for k, tasks in enumerate(stations):
+            for i in tasks:
+                stationOf[i] = k
+        stations = improveSearch(line, limit, stationOf, rng, deadline, succ, pred, topoPos)
+        weights = [ sum(line.times[k].tolist()) for k in stations ]
+        # a station over the limit is only allowed for a single task longer than the limit
+        if all( w <= limit or len(k) == 1 for k, w in zip(stations, weights) ):
+            score = improveScore(weights, limit)
+            if bestScore is None or score < bestScore:
+                best, bestScore = stations, score
+        if time.perf_counter() >= deadline:
+            break
+        priority = rules[rng.integers(len(rules))] * rng.uniform(0.7, 1.3, line.numTasks)
+        stations = assignStations(line, None, limit, np.argsort(-priority, kind='stable')).stations
+    return best, bestScore
+# End of improveWorker()
+
+# function to search for a better balancing than the RPW one, within seconds of wall clock time
+#~baselines: { name: (limit, BalancedLine) }, the balanced lines to improve, searched at the same time
+#~rpw_weights: the positional weights, for the restarts, worked out when None
+#~jobs: the number of worker processes, shared between the balanced lines
+#~Returns { name: BalancedLine }, the best balancing found for each, which is the baseline when nothing better was
+#~found
+def improveBalance(line, baselines, rpw_weights, seconds, jobs):
+    if rpw_weights is None:
+        rpw_weights = calculatePositionalWeights(line)
+    perLine = max(1, jobs // len(baselines))
+    work = [ (name, seed) for name in baselines for seed in range(perLine) ]
+    budget = seconds * min(jobs, len(work)) / len(work)    # the workers that cannot start at once share the time
+    if jobs == 1:
+        # e.g. inside a batch worker, the search runs in this process
+        found = [ (name, improveWorker(line, baselines[name][0], baselines[name][1].stations, rpw_weights, budget, seed)) for name, seed in work ]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(work))) as pool:
+            futures = [ (name, pool.submit(improveWorker, line, baselines[name][0], baselines[name][1].stations, rpw_weights, budget, seed))
+                        for name, seed in work ]
+            found = [ (name, future.result()) for name, future in futures ]
+
+    improved = dict()
+    for name, (limit, baseline) in baselines.items():
+        best, bestScore = baseline, improveScore(baseline.weights, limit)
+        for stations, score in [ k[1] for k in found if k[0] == name ]:
+            if stations is not None and score < bestScore:
+                best, bestScore = BalancedLine(line, stations, [ sum(line.times[k].tolist()) for k in stations ]), score
+        improved[name] = best
+    return improved
+# End of improveBalance()
+
+# Monte Carlo simulation of the throughput of a balanced line
+#~The stations work in series, the first station always has work and the last station can always pass its units
+#~on. The time a station takes for a unit is the sum of its task times, each drawn from the distribution of the
+#~task (see sampleTaskTimes()). The departure times of the units from station k follow
+#~    D_k[n] = max( max(D_k-1[n], D_k[n-1]) + S_k[n], D_k+1[n-b_k-1] )
+#~where S_k[n] is the time station k takes for unit n, and b_k is the buffer after station k; with no limit to the
+#~buffers the last term is dropped. For a station, this is x[n] = max(x[n-1] + s[n], c[n]), which unrolls to
+#~    x[n] = P[n] + max over j <= n of (c[j] - P[j]),    P the running sum of s
+#~so a whole station is worked out with np.cumsum() and np.maximum.accumulate(), for all the units and
+#~replications at once, and only the stations are looped over. With limited buffers c depends on the next
+#~station, the stations are swept over again (Gauss-Seidel) from the unlimited buffer solution, each sweep
+#~can only make units later, until nothing changes. A buffer of b units means unit n leaves station k only once
+#~unit n-b-1 has left station k+1 (blocking after service).
+simulationFamilies = ('deterministic', 'normal', 'lognormal', 'gamma', 'exponential', 'uniform')
+simulationChunk = 2**22    # the replications are simulated in chunks of at most this many station-unit times
+simulationWindow = 16      # units settled at a time with limited buffers
+simulationSweepsMax = 10000
+
+# function to draw task times with the given mean, from the family of distributions with the given coefficient
+# of variation (standard deviation / mean). The exponential distribution always has a cv of 1, normal task
+# times are cut off at 0.
+def sampleTaskTimes(rng, mean, family, cv, shape):
+    if family == 'deterministic' or (cv == 0 and family != 'exponential'):
+        return np.full(shape, mean)
+    if family == 'normal':
+        return np.maximum(rng.normal(mean, cv*mean, shape), 0)
+    if family == 'lognormal':
+        sigma2 = np.log(1 + cv**2)
+        return rng.lognormal(np.log(mean) - sigma2/2, np.sqrt(sigma2), shape)
+    if family == 'gamma':
+        return rng.gamma(1/cv**2, mean*cv**2, shape)
+    if family == 'exponential':
+        return rng.exponential(mean, shape)
+    if family == 'uniform':
+        half = np.sqrt(3)*cv*mean
+        return rng.uniform(max(mean - half, 0), mean + half, shape)
+    raise ValueError("Unknown task time distribution " + str(family) + ", use one of " + ", ".join(simulationFamilies))
+# End of sampleTaskTimes()
+
+# function to read the task time distributions, one line for each task in the order of tasktime.txt
+#~Each line is 'family' or 'family,cv', e.g. 'lognormal,0.3'; a task without a cv takes the one given.
+#~Returns the family and cv of every task, all of them the ones given when the file is not there
+def readTaskDistributions(fname, numTasks, family, cv):
+    families = [ family ] * numTasks
+    cvs = [ cv ] * numTasks
+    if not os.path.isfile(fname):
+        return families, cvs
+    count = 0
+    for lineNumber, text in readEntries(fname):
+        parts = [ k.strip() for k in text.split(',') ]
+        if count >= numTasks:
+            raise ValueError(fname + ":" + str(lineNumber) + ": there are only " + str(numTasks) + " tasks")
+        try:
+            if parts[0] not in simulationFamilies or len(parts) > 2 or (len(parts) == 2 and float(parts[1]) < 0):
+                raise ValueError
+            families[count] = parts[0]
+            cvs[count] = float(parts[1]) if len(parts) == 2 else cv
+        except ValueError:
+            raise ValueError(fname + ":" + str(lineNumber) + ": a task time distribution is 'family' or 'family,cv', " +
+                             "family one of " + ", ".join(simulationFamilies) + ": " + text)
+        count += 1
+    if count != numTasks:
+        raise ValueError(fname + " has " + str(count) + " task time distributions, but " + tasktimes_file + " has " + str(numTasks) + " task times")
+    return families, cvs
+# End of readTaskDistributions()
+
+# function to work out the departure times of the units from each station, see the note above
+#~S: the station times, shape (stations, replications, units)
+#~buffers: the size of the buffer after each station but the last, None when they have no limit
+#~With limited buffers the units are worked out simulationWindow at a time, the sweeps over the stations only
+#~need to settle the units in the window, the ones before it are already final.
+#~Returns the departure times, the same shape as S
+def departureTimes(S, buffers=None):
+    numStations, reps, units = S.shape
+    D = np.empty_like(S)
+    window = units if buffers is None else simulationWindow
+    for first in range(0, units, window):
+        last = min(first + window, units)
+        s = S[:, :, first:last]
+        P = np.cumsum(s, axis=2)
+        current = D[:, :, first:last]
+        blocked = np.empty((reps, last-first))
+
+        def solve(k, blocked):
+            c = current[k-1] + s[k] if k else s[k].copy()
+            if first:
+                # carry on from the unit before the window
+                np.maximum(c[:, 0], D[k, :, first-1] + s[k, :, 0], out=c[:, 0])
+            if blocked is not None:
+                np.maximum(c, blocked, out=c)
+            current[k] = P[k] + np.maximum.accumulate(c - P[k], axis=1)
+
+        for k in range(numStations):
+            solve(k, None)
+        if buffers is None:
+            continue
+
+        # a station is solved again only when the station before or after it has changed
+        stale = np.ones(numStations, dtype=bool)
+        stale[-1] = False
+        for sweep in range(simulationSweepsMax):
+            if not stale.any():
+                break
+            # every other sweep runs back up the line, so blocking reaches up the line in one sweep as well
+            for k in np.flatnonzero(stale)[::1 if sweep % 2 else -1]:
+                stale[k] = False
+                if k < numStations - 1:
+                    # unit n can only leave station k once unit n-b-1 has left station k+1
+                    source = np.arange(first, last) - (buffers[k] + 1)
+                    waiting = source >= 0
+                    blocked[:, ~waiting] = -np.inf
+                    blocked[:, waiting] = D[k+1][:, source[waiting]]
+                before = current[k].copy()
+                solve(k, blocked if k < numStations - 1 else None)
+                if not np.array_equal(before, current[k]):
+                    stale[max(k-1, 0):k+2] = True
+                    stale[k] = False
+        else:
+            raise ValueError("The simulation did not settle after " + str(simulationSweepsMax) + " sweeps")
+    return D
+# End of departureTimes()
+
+# function to simulate a balanced line, many replications at once
+#~stations: the tasks in each station, as in BalancedLine.stations
+#~families, cvs: the task time distribution of every task, see readTaskDistributions()
+#~units: the units made in each replication, the first warmup fraction of them is left out of the figures
+#~Returns a dictionary of
+#~  'throughput'             - the mean number of units per time unit over the replications
+#~  'throughput ci'          - its 95% confidence interval
+#~  'throughput std'         - the standard deviation over the replications
+#~  'utilization'            - the fraction of the time each station is busy, the mean over the replications
+#~  'replications', 'units'
+def simulateLine(line, stations, families, cvs, units, replications, buffers=None, warmup=0.1, seed=None):
+    numStations = len(stations)
+    if buffers is not None and len(buffers) != numStations - 1:
+        raise ValueError("There are " + str(numStations) + " stations, so " + str(numStations-1) + " buffers between them, got " + str(len(buffers)))
+    rng = np.random.default_rng(seed)
+    warm = int(units * warmup)
+    if units - warm < 1:
+        raise ValueError("There are no units left after the warm up, simulate more units")
+    chunk = int(max(1, min(replications, simulationChunk // (units * numStations))))
+
+    throughput = np.empty(replications)
+    busy = np.empty((replications, numStations))
+    for start in range(0, replications, chunk):
+        reps = min(chunk, replications - start)
+        S = np.zeros((numStations, reps, units))
+        for k, tasks in enumerate(stations):
+            for i in tasks:
+                S[k] += sampleTaskTimes(rng, float(line.times[i]), families[i], cvs[i], (reps, units))
+        D = departureTimes(S, buffers)
+        window = D[-1][:, -1] - (D[-1][:, warm-1] if warm else 0)
+        throughput[start:start+reps] = (units - warm) / window
+        busy[start:start+reps] = (S[:, :, warm:].sum(axis=2) / window).T
+
+    std = float(throughput.std(ddof=1)) if replications > 1 else 0.0
+    half = 1.96 * std / np.sqrt(replications)
+    mean = float(throughput.mean())
+    return { 'throughput': mean, 'throughput ci': (mean - half, mean + half), 'throughput std': std,
+             'utilization': busy.mean(axis=0).tolist(), 'replications': replications, 'units': units }
+# End of simulateLine()
+
+# incremental re-balancing, for small changes to a line that has already been balanced
+#~The balancer keeps the reachable bitsets and the positional weights of the line, and for each limit it has
+#~balanced against, the stations and the step at which each task became ready. A change of task times, or added
+#~edges, only changes the positional weights of the tasks upstream of the change, and those are updated by adding
+#~the change. The assignment only depends on the order of the ready tasks, so the tasks that matter are the ones
+#~that swapped places in the ranking, the tasks whose time changed, and the tasks on the end of an added edge. Up
+#~to the first step at which one of those was ready, the assignment picks exactly what it picked before, so the
+#~stations up to the one that was open at that step are kept and only the rest are assigned again.
+#~The positional weights are kept as whole numbers of the decimalScale() of the task times, so adding the change
+#~is exact, and the result is the same as balancing the line from scratch. Task times with more decimals than
+#~that fall back to working out all the positional weights again.
+class IncrementalBalancer:
+    def __init__(self, line):
+        self.line = line
+        self.reachable = calculateReachable(line)
+        self.scale = decimalScale(line.times)
+        if self.scale is not None:
+            self.scaledWeights = reachableSums(scaledTimes(line.times, self.scale), self.reachable)
+            self.rpw_weights = self.scaledWeights / self.scale
+        else:
+            self.rpw_weights = weightsFromReachable(line, self.reachable)
+        self.rankedTasks = rankNodes(self.rpw_weights)
+        self.assignments = dict()    # limit -> (BalancedLine, readyStep)
+
+    # the state of the balancer as plain arrays, for saveBalancer()
+    #~The bitsets are left out, they are quicker to work out again than to read back. The stations of the k-th
+    #~limit are kept as the tasks in the order they were picked, stations_k, and the number in each station.
+    def toArrays(self):
+        arrays = { 'format': np.array(incrementalFormat),
+                   'times': self.line.times, 'succIndptr': self.line.succIndptr, 'succIndices': self.line.succIndices,
+                   'ids': np.array(self.line.ids, dtype=str),
+                   'scale': np.array(self.scale or 0), 'rpw_weights': self.rpw_weights, 'rankedTasks': self.rankedTasks,
+                   'limits': np.array(list(self.assignments), dtype=float) }
+        if self.scale is not None:
+            arrays['scaledWeights'] = self.scaledWeights
+        for k, (balanced, readyStep) in enumerate(self.assignments.values()):
+            arrays['stations_' + str(k)] = np.array([ i for tasks in balanced.stations for i in tasks ], dtype=np.int64)
+            arrays['stationSizes_' + str(k)] = np.array([ len(tasks) for tasks in balanced.stations ], dtype=np.int64)
+            arrays['weights_' + str(k)] = balanced.weights
+            arrays['readyStep_' + str(k)] = np.array(readyStep, dtype=np.int64)
+        return arrays
+
+    # the balancer saved by toArrays()
+    #~Raises KeyError or ValueError when the arrays are not a balancer state this version can read
+    @classmethod
+    def fromArrays(cls, arrays):
+        if int(arrays['format']) != incrementalFormat:
+            raise ValueError("Incremental state format " + str(int(arrays['format'])) + ", expected " + str(incrementalFormat))
+        succIndptr = arrays['succIndptr']
+        edges = np.column_stack(( np.repeat(np.arange(len(succIndptr) - 1), np.diff(succIndptr)), arrays['succIndices'] ))
+        self = cls.__new__(cls)
+        self.line = LineModel(arrays['times'], edges, ids=arrays['ids'].tolist())
+        self.reachable = calculateReachable(self.line)
+        self.scale = int(arrays['scale']) or None
+        if self.scale is not None:
+            self.scaledWeights = arrays['scaledWeights']
+        self.rpw_weights = arrays['rpw_weights']
+        self.rankedTasks = arrays['rankedTasks']
+        self.assignments = dict()
+        for k, limit in enumerate(arrays['limits'].tolist()):
+            ends = np.cumsum(arrays['stationSizes_' + str(k)])
+            stations = [ tasks.tolist() for tasks in np.split(arrays['stations_' + str(k)], ends[:-1]) ] if len(ends) else []
+            self.assignments[limit] = (BalancedLine(self.line, stations, arrays['weights_' + str(k)]), arrays['readyStep_' + str(k)].tolist())
+        return self
+
+    # the balanced line for limit, assigned in full the first time a limit is asked for
+    def balance(self, limit):
+        if limit not in self.assignments:
+            readyStep = [0] * self.line.numTasks
+            balanced = assignStations(self.line, self.rpw_weights, limit, self.rankedTasks, readyStep=readyStep)
+            self.assignments[limit] = (balanced, readyStep)
+        return self.assignments[limit][0]
+
+    # forget the assignments for any other limits
+    def keepLimits(self, limits):
+        self.assignments = { k: v for k, v in self.assignments.items() if k in limits }
+
+    # the tasks upstream of task i, itself included, in the precedence of the current line
+    def ancestors(self, i):
+        predIndptr = self.line.predIndptr
+        predIndices = self.line.predIndices
+        seen = { i }
+        stack = [ i ]
+        while stack:
+            i = stack.pop()
+            for j in predIndices[predIndptr[i]:predIndptr[i+1]].tolist():
+                if j not in seen:
+                    seen.add(j)
+                    stack.append(j)
+        return seen
+
+    # bring the balancer up to date with a new version of the line
+    #~Returns False when the change is not one that can be made incrementally, a different number of tasks or a
+    #~removed edge, the caller then starts a new balancer. Raises ValueError when an added edge makes a loop.
+    def update(self, line):
+        oldLine = self.line
+        if line.numTasks != oldLine.numTasks or line.ids != oldLine.ids:
+            return False
+        addedEdges = list()
+        if not (np.array_equal(line.succIndptr, oldLine.succIndptr) and np.array_equal(line.succIndices, oldLine.succIndices)):
+            oldEdges = set(zip(np.repeat(np.arange(oldLine.numTasks), np.diff(oldLine.succIndptr)).tolist(), oldLine.succIndices.tolist()))
+            newEdges = list(zip(np.repeat(np.arange(line.numTasks), np.diff(line.succIndptr)).tolist(), line.succIndices.tolist()))
+            if not oldEdges.issubset(newEdges):
+                return False
+            addedEdges = [ k for k in newEdges if k not in oldEdges ]
+            line.topologicalOrder()    # raises ValueError when an added edge makes a loop
+        changedTimes = np.flatnonzero(line.times != oldLine.times).tolist()
+        self.line = line
+
+        newScale = decimalScale(line.times)
+        exact = self.scale is not None and newScale is not None
+        if exact:
+            # the change is worked out at the finer of the two scales, it divides back exactly
+            common = max(self.scale, newScale)
+            scaledWeights = self.scaledWeights * (common // self.scale)
+            oldValues = scaledTimes(oldLine.times, common)
+            newValues = scaledTimes(line.times, common)
+
+        # an added edge u -> v makes everything reachable from v reachable from u and the tasks upstream of u
+        for u, v in addedEdges:
+            for a in self.ancestors(u):
+                newBits = self.reachable[v] & ~self.reachable[a]
+                if newBits:
+                    self.reachable[a] |= newBits
+                    if exact:
+                        # at the old task times, the change in task times is added below for all the reachable tasks
+                        scaledWeights[a] += oldValues[bitsetMask(newBits, line.numTasks)].sum()
+        if exact:
+            for i in changedTimes:
+                scaledWeights[list(self.ancestors(i))] += newValues[i] - oldValues[i]
+            self.scaledWeights = scaledWeights // (common // newScale)
+            self.rpw_weights = self.scaledWeights / newScale
+        else:
+            self.rpw_weights = weightsFromReachable(line, self.reachable)
+            if newScale is not None:
+                self.scaledWeights = reachableSums(scaledTimes(line.times, newScale), self.reachable)
+        self.scale = newScale
+
+        # the tasks that swapped places with another task in the ranking
+        oldRanked = self.rankedTasks
+        self.rankedTasks = rankNodes(self.rpw_weights)
+        newRank = np.empty(line.numTasks, dtype=np.int64)
+        newRank[self.rankedTasks] = np.arange(line.numTasks)
+        seq = newRank[oldRanked]
+        swapped = oldRanked[ (np.maximum.accumulate(seq) > seq) | (np.minimum.accumulate(seq[::-1])[::-1] < seq) ]
+        changed = np.array(changedTimes + [ v for u, v in addedEdges ], dtype=np.int64)
+        if len(swapped) == 0 and len(changed) == 0:
+            return True
+        profiler.count("IncrementalBalancer tasks affected", len(swapped) + len(changed))
+
+        for limit, (balanced, readyStep) in self.assignments.items():
+            # the first step that could pick differently. A task that changed time or gained a predecessor changes
+            # the steps it is ready for. The task picked at a step is the highest ranked ready task that fits, when
+            # it did not swap places with any task it is still ahead of all the tasks it was ahead of, and behind
+            # the ones that did not fit, so it is picked again, the first step that could differ is the first one
+            # that picked a swapped task.
+            firstStep = line.numTasks
+            if len(changed):
+                firstStep = int(np.asarray(readyStep)[changed].min())
+            if len(swapped):
+                pickedAt = np.empty(line.numTasks, dtype=np.int64)
+                pickedAt[np.concatenate(balanced.stations)] = np.arange(line.numTasks)
+                firstStep = min(firstStep, int(pickedAt[swapped].min()))
+            if firstStep >= line.numTasks:
+                continue
+
+            # the decisions before firstStep are the same as before, the station open at firstStep-1 is assigned again
+            stationEnd = np.cumsum([ len(k) for k in balanced.stations ])
+            keep = int(np.searchsorted(stationEnd, firstStep - 1, side='right')) if firstStep > 0 else 0
+            rebalanced = assignStations(line, self.rpw_weights, limit, self.rankedTasks, balanced.stations[:keep], readyStep)
+            self.assignments[limit] = (rebalanced, readyStep)
+            profiler.count("IncrementalBalancer stations kept", keep)
+        return True
+# End of IncrementalBalancer
+
+# function to balance a line model at the takt time and at the highest task time, and for a fixed number of
+# stations when one is given. Nothing is printed, read or written, so it can be called from another program.
+#~worktimeDemand: (work days in a year, work hours in a day, annual demand)
+#~unit: 'hrs', 'min' or 'sec', the unit of the task times
+#~Returns a dictionary of
+#~  'takt time', 'highest task time', 'total work time', 'total task time'
+#~  'balanced' - { 'takt': BalancedLine, 'highest': BalancedLine, 'stations': BalancedLine or None }
+#~  'limits'   - the cycle time each of them was balanced against, { 'takt': ..., 'highest': ..., 'stations': ... }
+#~  'metrics'  - balancedLineMetrics() for each of them
+#~  'rpw weights' - the positional weights of the tasks, for balancing the same line again
+#~rpw_weights: the positional weights of the line when they are already known, see calculateRPW()
+#~balancer: an IncrementalBalancer that is up to date with the line, the positional weights and the assignments
+#~          come from it
+def balanceModel(line, worktimeDemand, unit, stations=None, rpw_weights=None, balancer=None):
+    workdays, workhours, demand = worktimeDemand
+    totalworktime = float(workdays) * float(workhours) * float(timeMultiplier[unit])
+    takttime = totalworktime / float(demand)
+    maxTaskTime = float(line.times.max())
+    totalProcessingTime = float(line.times.sum())
+
+    if balancer is not None:
+        rpw_weights = balancer.rpw_weights
+        assign = balancer.balance
+    else:
+        if rpw_weights is None:
+            with profiler.stage("calculatePositionalWeights"):
+                rpw_weights = calculatePositionalWeights(line)
+        assign = lambda limit: assignStations(line, rpw_weights, limit)
+    with profiler.stage("assignStations (takt)"):
+        G_takt_balanced = assign(takttime)
+    with profiler.stage("assignStations (highest)"):
+        G_highest_balanced = assign(maxTaskTime)
+
+    balanced = { 'takt': G_takt_balanced, 'highest': G_highest_balanced, 'stations': None }
+    limits = { 'takt': takttime, 'highest': maxTaskTime, 'stations': None }
+    if stations is not None:
+        with profiler.stage("calculateMinCycleTime"):
+            limits['stations'], balanced['stations'] = calculateMinCycleTime(line, stations, rpw_weights)
+
+    return { 'takt time': takttime, 'highest task time': maxTaskTime, 'total work time': totalworktime,
+             'total task time': totalProcessingTime, 'balanced': balanced, 'limits': limits, 'rpw weights': rpw_weights,
+             'metrics': { k: balancedLineMetrics(v, limits[k], totalProcessingTime, totalworktime)
+                          for k, v in balanced.items() if v is not None } }
+#~End of balanceModel
+
+# function to read the incremental balancer kept in the line directory and bring it up to date with the line
+#~The state is plain arrays, read without pickle, so a line directory shared with others cannot run code.
+#~A new balancer is started when there is none, it was saved in another format, it cannot be read, or the line
+#~changed in a way IncrementalBalancer.update() cannot follow.
+def loadBalancer(fname, line):
+    try:
+        with np.load(fname, allow_pickle=False) as data:
+            balancer = IncrementalBalancer.fromArrays(data)
+    except (OSError, EOFError, ValueError, KeyError, TypeError, IndexError, zipfile.BadZipFile):
+        balancer = None
+    if balancer is None or not balancer.update(line):
+        balancer = IncrementalBalancer(line)
+    return balancer
+# End of loadBalancer()
+
+def saveBalancer(fname, balancer):
+    tmpName = fname + ".tmp-" + str(os.getpid())
+    with open(tmpName, 'wb') as f:
+        np.savez(f, **balancer.toArrays())
+    os.replace(tmpName, fname)
+# End of saveBalancer()
+
+# function to balance a line given as plain lists, see balanceModel() for what is returned
+#~task_times: the task time of each task
+#~edges:      pairs of task numbers (from, to), the tasks are numbered from 1 in the order of task_times, as in
+#~            edges_nodes.txt, and the groups of the balanced lines use the same numbers
+#~names:      the task names, or None
+#~worktime:   (work days in a year, work hours in a day, annual demand)
+#~Raises ValueError when an edge refers to a task that does not exist, or the precedence has a loop
+def balance(task_times, edges, names, worktime, unit, stations=None):
+    line = LineModel.fromTaskNumbers(task_times, edges, names)
+    result = balanceModel(line, worktime, unit, stations)
+    result['line'] = line
+    return result
+#~End of balance
+
+# function to balance the line in one directory, writing the report and the figures to that directory
+#~parallelRender: draw the figures in a process pool, turned off inside the batch workers
+#~Returns a summary of the line, the figures of merit for each of the balanced lines, or in sweep mode the
+#~sweep table written
+def balanceLine(lineDir, args, parallelRender=True):
+    workingDir = lineDir
+
+#----------------------- Construction of the line model and calculations -------------------------------- 
+    with profiler.stage("load line"):
+        G, worktimeDemand = loadLine(workingDir)
     
-    workdays, workhours, demand = worktimeDemand[0].split(',')
+    workdays, workhours, demand = worktimeDemand
     totalworktime = float(workdays) * float(workhours) * float(timeMultiplier[args.unit])
     takttime = totalworktime / float(demand)
     
-#----------------------- Construction of the diGraph and calculations ----------------------------------- 
-    G = nx.DiGraph()
-
-    G.add_nodes_from( [str(i) for i in range(1, len(taskTimes)+1)] )
-    nx.set_node_attributes(G, { str(i): {'name':taskNames[i-1]} for i in range(len(taskNames)+1) } )
-    nx.set_node_attributes(G, { str(i): {'weight':float(taskTimes[i-1])} for i in range(len(taskTimes)+1) } )
-    [ G.add_edges_from([ i.split(',') ]) for i in edges_nodes ]
-    labels = { str(k) : (str(k) + ", w: " + taskTimes[k-1]) for k in range(1,len(taskNames)+1) }
-    nx.set_node_attributes(G, {str(i): {'label': str(i)+"-("+str(taskTimes[i-1])+")" } for i in range(1,len(taskTimes)+1)} )
-    
-    plotGraph(G,workingDir + "/" + "rpw_out.png", "Unbalanced line")
-    
-    showImg(workingDir + "/" + "rpw_out.png")
+    if args.sweep or args.sweep_demand:
+        # sweep mode, only the table of stations against cycle time is produced
+        if args.sweep:
+            limits = parseSweepValues(args.sweep)
+        else:
+            limits = [ totalworktime/k for k in parseSweepValues(args.sweep_demand) ]
+        with profiler.stage("sweepStations"):
+            sweep = sweepStations(G, calculatePositionalWeights(G), limits)
+        writeSweepTable(workingDir + "/" + "Line_Balancing_Sweep.csv", sweep, totalworktime, args.unit)
+        return { 'line': lineDir, 'status': 'ok', 'tasks': G.numTasks, 'limits': len(limits),
+                 'sweep table': workingDir + "/" + "Line_Balancing_Sweep.csv" }
+
     print("Takttime: "+str(takttime))
-    G_takt_balanced = calculateRPW(G, takttime)
-    plotGraph(G_takt_balanced,workingDir + "/" + "rpw_out_takt_balanced.png", "Balanced line using takt time")
-    
-    showImg(workingDir + "/" + "rpw_out_takt_balanced.png")
-    maxTaskTime = max([ G.nodes[k].get('weight') for k in G.nodes ])
+    maxTaskTime = float(G.times.max())
 
-    G_highest_balanced = calculateRPW(G, maxTaskTime)
-    plotGraph(G_highest_balanced,workingDir + "/" + "rpw_out_highest_balanced.png", "Balanced line using highest time")
-    
-    showImg(workingDir + "/" + "rpw_out_highest_balanced.png")
-#--------------------- End of Construction of the diGraph and calculations ------------------------------  
+    key = None
+    result = None
+    if not args.no_cache:
+        with profiler.stage("cache lookup"):
+            key = cacheKey(G, worktimeDemand, args.unit, [ takttime, maxTaskTime, args.stations ])
+            result = cacheLoad(args.cache_dir, key, G)
+
+    if result is not None:
+        print("Balancing found in the cache, " + key)
+    else:
+        balancer = None
+        if args.incremental:
+            with profiler.stage("incremental update"):
+                balancer = loadBalancer(workingDir + "/" + incremental_file, G)
+        result = balanceModel(G, worktimeDemand, args.unit, args.stations, balancer=balancer)
+        if balancer is not None:
+            with profiler.stage("incremental save"):
+                balancer.keepLimits([ takttime, maxTaskTime ])
+                saveBalancer(workingDir + "/" + incremental_file, balancer)
+        if key is not None:
+            with profiler.stage("cache store"):
+                cacheStore(args.cache_dir, key, result, args.cache_size*1024*1024)
+    G_takt_balanced = result['balanced']['takt']
+    G_highest_balanced = result['balanced']['highest']
+    G_stations_balanced = result['balanced']['stations']
+    stationsCycleTime = result['limits']['stations']
+    if G_stations_balanced is not None:
+        print("Minimum cycle time for " + str(args.stations) + " stations: " + str(stationsCycleTime))
+
+    improved = dict()
+    if args.improve:
+        # not cached, the search is random and bounded by the time given
+        with profiler.stage("improveBalance"):
+            improved = improveBalance(G, { 'takt': (takttime, G_takt_balanced), 'highest': (maxTaskTime, G_highest_balanced) },
+                                      result.get('rpw weights'), args.improve, max(1, args.jobs if parallelRender else 1))
+        for name, G_improved in improved.items():
+            print("Improved balancing (" + name + "): " + str(result['balanced'][name].numStations) + " -> " + str(G_improved.numStations) + " stations")
+
+    simulated = dict()
+    if args.simulate:
+        # not cached either, the figures depend on the seed and the task time distributions
+        families, cvs = readTaskDistributions(workingDir + "/" + taskdist_file, G.numTasks, args.dist, args.cv)
+        for name, G_balanced in result['balanced'].items():
+            if G_balanced is None:
+                continue
+            buffers = parseBuffers(args.buffers, G_balanced.numStations)
+            with profiler.stage("simulateLine (" + name + ")"):
+                sim = simulateLine(G, G_balanced.stations, families, cvs, args.simulate, args.replications, buffers, args.warmup, args.seed)
+            simulated[name] = (G_balanced, buffers, sim)
+            print("Simulated throughput (" + name + "): " + "{:.2f}".format(sim['throughput']*totalworktime) + " units, " +
+                  "{:.2f}".format(result['metrics'][name]['max units']) + " at most")
+#------------------- End of Construction of the line model and calculations -----------------------------  
 
     # Create the reportVarList, a dictionary of all the variables needed to generate the report
     reportVarList = {}
@@ -348,25 +1848,62 @@ def main(argv):
     reportVarList['G'] = G
     reportVarList['G_takt_balanced'] = G_takt_balanced
     reportVarList['G_highest_balanced'] = G_highest_balanced
-    createReport(reportVarList)
+    reportVarList['stations'] = args.stations
+    reportVarList['stations cycletime'] = stationsCycleTime
+    reportVarList['G_stations_balanced'] = G_stations_balanced
+    reportVarList['G_takt_improved'] = improved.get('takt')
+    reportVarList['G_highest_improved'] = improved.get('highest')
+    reportVarList['improve seconds'] = args.improve
+    reportVarList['simulated'] = simulated
+    if simulated:
+        taskTimes = args.dist + ", cv " + "{:.2f}".format(args.cv)
+        if os.path.isfile(workingDir + "/" + taskdist_file):
+            taskTimes = "from " + taskdist_file + " (cv " + "{:.2f}".format(args.cv) + " where it is not given)"
+        reportVarList['simulation'] = { 'task times': taskTimes }
+    with profiler.stage("createReport"):
+        createReport(reportVarList, workingDir + "/" + "Line_Balancing_Report.txt")
+
+    summary = { 'line': lineDir, 'status': 'ok', 'takt time': takttime, 'highest task time': maxTaskTime,
+                'tasks': G.numTasks, 'total task time': result['total task time'] }
+    if G_stations_balanced is not None:
+        summary['stations cycle time'] = stationsCycleTime
+    for name, metrics in result['metrics'].items():
+        summary.update({ k + " (" + name + ")": v for k, v in metrics.items() })
+    for name, G_improved in improved.items():
+        metrics = balancedLineMetrics(G_improved, result['limits'][name], result['total task time'], totalworktime)
+        summary.update({ k + " (" + name + " improved)": v for k, v in metrics.items() })
+    for name, (G_balanced, buffers, sim) in simulated.items():
+        summary['expected units (' + name + ' simulated)'] = sim['throughput'] * totalworktime
+        summary['expected units ci low (' + name + ' simulated)'] = sim['throughput ci'][0] * totalworktime
+        summary['expected units ci high (' + name + ' simulated)'] = sim['throughput ci'][1] * totalworktime
     
+    if args.no_render:
+        return summary
+
+    # the figures are only drawn once the balancing and the report are done, see renderAll()
+    renderJobs = list()
+    renderJobs.append( ('graph', G, workingDir + "/" + "rpw_out.png", "Unbalanced line") )
+    renderJobs.append( ('graph', G_takt_balanced, workingDir + "/" + "rpw_out_takt_balanced.png", "Balanced line using takt time") )
+    renderJobs.append( ('graph', G_highest_balanced, workingDir + "/" + "rpw_out_highest_balanced.png", "Balanced line using highest time") )
+    if G_stations_balanced is not None:
+        renderJobs.append( ('graph', G_stations_balanced, workingDir + "/" + "rpw_out_stations_balanced.png", "Balanced line using " + str(args.stations) + " stations") )
+
     # plot the bar graph for the unbalanced line showing idle times and task times
-    unbalanced_task_times = [ G.nodes[k].get('weight') for k in G.nodes ]
+    unbalanced_task_times = G.times.tolist()
     unbalanced_idle_times = [ takttime - j for j in unbalanced_task_times ]
     
     barPlotVar = {}
     barPlotVar['task times'] = unbalanced_task_times
     barPlotVar['idle times'] = unbalanced_idle_times
     barPlotVar['title'] = "Unbalanced line with task times and idle times"
-    barPlotVar['xTickLabels'] = [ k for k in G.nodes.keys() ]
+    barPlotVar['xTickLabels'] = G.ids
     barPlotVar['xLabel'] = "Task numbers"
     barPlotVar['yLabel'] = "Processing time (hrs)"
     barPlotVar['output file'] = workingDir + "/" + "rpw_stackBar_unbalanced.png"
-    plotStackBarChart(barPlotVar)
-    showImg(barPlotVar['output file'])
+    renderJobs.append( ('bar', barPlotVar) )
     
     # plot the bar graph for the unbalanced line showing idle times and task times
-    takt_balanced_task_times = [ G_takt_balanced.nodes[k].get('weight') for k in G_takt_balanced.nodes ]
+    takt_balanced_task_times = G_takt_balanced.weights.tolist()
     takt_balanced_idle_times = [ takttime - j for j in takt_balanced_task_times ]
     
     barPlotVar = {}
@@ -374,28 +1911,467 @@ def main(argv):
     barPlotVar['idle times'] = takt_balanced_idle_times
     barPlotVar['title'] = "Task times and idle times distribution (takt time)"
     barPlotVar['title'] = "Takt time balanced line with task times and idle times"
-    barPlotVar['xTickLabels'] = [ k for k in G_takt_balanced.nodes.keys() ]
+    barPlotVar['xTickLabels'] = list(range(1, G_takt_balanced.numStations+1))
     barPlotVar['xLabel'] = "Task numbers"
     barPlotVar['yLabel'] = "Processing time (" + args.unit + ")"
     barPlotVar['output file'] = workingDir + "/" + "rpw_stackBar_takt_balanced.png"
-    plotStackBarChart(barPlotVar)
-    showImg(barPlotVar['output file'])
+    renderJobs.append( ('bar', barPlotVar) )
 
     # plot the bar graph for the unbalanced line showing idle times and task times
-    highest_balanced_task_times = [ G_highest_balanced.nodes[k].get('weight') for k in G_highest_balanced.nodes ]
-    highestTaskTime = np.max([ G.nodes[k].get('weight') for k in G.nodes ])
+    highest_balanced_task_times = G_highest_balanced.weights.tolist()
+    highestTaskTime = maxTaskTime
     highest_balanced_idle_times = [ highestTaskTime - j for j in highest_balanced_task_times ]
     
     barPlotVar = {}
     barPlotVar['task times'] = highest_balanced_task_times
     barPlotVar['idle times'] = highest_balanced_idle_times
     barPlotVar['title'] = "Task times and idle times distribution (highest task time)"
-    barPlotVar['xTickLabels'] = [ k for k in G_highest_balanced.nodes.keys() ]
+    barPlotVar['xTickLabels'] = list(range(1, G_highest_balanced.numStations+1))
     barPlotVar['xLabel'] = "Task numbers"
     barPlotVar['yLabel'] = "Processing time (" + args.unit + ")"
     barPlotVar['output file'] = workingDir + "/" + "rpw_stackBar_highest_balanced.png"
-    plotStackBarChart(barPlotVar)
-    showImg(barPlotVar['output file'])
+    renderJobs.append( ('bar', barPlotVar) )
+
+    outputFiles = [ job[2] if job[0] == 'graph' else job[1]['output file'] for job in renderJobs ]
+    # the improved balancing changes from run to run, so its figures are drawn every time and not cached
+    improvedJobs = [ ('graph', G_improved, workingDir + "/" + "rpw_out_" + name + "_improved.png", "Improved balanced line using " + name + " time")
+                     for name, G_improved in improved.items() ]
+    with profiler.stage("render"):
+        if key is None or not cacheRestoreArtifacts(args.cache_dir, key, outputFiles):
+            renderJobs += improvedJobs
+            improvedJobs = []
+            outputFiles = renderAll(renderJobs, parallelRender)
+            if key is not None:
+                cacheStoreArtifacts(args.cache_dir, key, outputFiles[:len(outputFiles)-len(improved)], args.cache_size*1024*1024)
+        outputFiles += renderAll(improvedJobs, parallelRender)
+    if parallelRender and not (args.headless or noDisplay()):
+        [ showImg(fname) for fname in outputFiles ]
+    return summary
+# End of balanceLine()
+
+# function to work out the cache key of a line, a hash of everything that the balancing and the figures
+# depend on. The task names are left out, they only show up in the report, which is always written afresh.
+def cacheKey(line, worktimeDemand, unit, limits):
+    keyData = { 'version': scriptVersion,
+                'format': cacheFormat,
+                'worktime demand': list(worktimeDemand),
+                'unit': unit,
+                'limits': limits }
+    key = hashlib.sha256(json.dumps(keyData, sort_keys=True).encode())
+    key.update(line.times.tobytes())
+    key.update(line.succIndptr.tobytes())
+    key.update(line.succIndices.tobytes())
+    return key.hexdigest()
+# End of cacheKey()
+
+# function to read the balancing results of a line from the cache, returns None when it is not cached
+#~The balanced lines are kept as plain data (see cacheStore()) and built again on the line given, so an entry
+#~does not depend on the module that wrote it, the script or a program that imports it.
+def cacheLoad(cacheDir, key, line):
+    try:
+        with open(os.path.join(cacheDir, key, "balancing.json")) as f:
+            result = json.load(f)
+        result['balanced'] = { name: None if k is None else BalancedLine(line, k['stations'], k['weights'])
+                               for name, k in result['balanced'].items() }
+        os.utime(os.path.join(cacheDir, key))    # the directory time stamp is the last use, for the LRU eviction
+        return result
+    except (OSError, ValueError, KeyError, TypeError, IndexError):
+        return None
+# End of cacheLoad()
+
+# function to write the balancing results of a line to the cache
+#~The balanced lines are written as the task numbers of each station and the station times, the rest of the
+#~result is numbers already.
+#~The entry is written to a temporary directory and renamed into place, so an entry is either complete or not
+#~there at all, even with several batch workers writing to the same cache.
+def cacheStore(cacheDir, key, result, maxBytes):
+    os.makedirs(cacheDir, exist_ok=True)
+    tmpDir = tempfile.mkdtemp(dir=cacheDir, prefix=".tmp-")
+    entry = { k: v for k, v in result.items() if k != 'rpw weights' }    # quick to work out again when needed
+    entry['balanced'] = { name: None if k is None else { 'stations': [ [ int(i) for i in tasks ] for tasks in k.stations ],
+                                                         'weights': [ float(w) for w in k.weights ] }
+                          for name, k in result['balanced'].items() }
+    with open(os.path.join(tmpDir, "balancing.json"), 'w') as f:
+        json.dump(entry, f)
+    try:
+        os.rename(tmpDir, os.path.join(cacheDir, key))
+    except OSError:
+        shutil.rmtree(tmpDir, ignore_errors=True)    # another process got there first
+    cacheEvict(cacheDir, maxBytes)
+# End of cacheStore()
+
+# function to copy the figures of a line out of the cache, returns False unless every one of them is cached
+def cacheRestoreArtifacts(cacheDir, key, fnames):
+    cached = [ os.path.join(cacheDir, key, os.path.basename(k)) for k in fnames ]
+    if not all( os.path.isfile(k) for k in cached ):
+        return False
+    try:
+        [ shutil.copyfile(cached[k], fnames[k]) for k in range(len(fnames)) ]
+    except OSError:
+        return False
+    return True
+# End of cacheRestoreArtifacts()
+
+def cacheStoreArtifacts(cacheDir, key, fnames, maxBytes):
+    entryDir = os.path.join(cacheDir, key)
+    if not os.path.isdir(entryDir):
+        return
+    for fname in fnames:
+        tmpName = os.path.join(entryDir, ".tmp-" + str(os.getpid()) + "-" + os.path.basename(fname))
+        shutil.copyfile(fname, tmpName)
+        os.replace(tmpName, os.path.join(entryDir, os.path.basename(fname)))
+    cacheEvict(cacheDir, maxBytes)
+# End of cacheStoreArtifacts()
+
+# function to keep the cache within its size, the least recently used entries are removed first
+def cacheEvict(cacheDir, maxBytes):
+    entries = list()
+    for entry in os.scandir(cacheDir):
+        if not entry.is_dir() or entry.name.startswith(".tmp-"):
+            continue
+        try:
+            size = sum( k.stat().st_size for k in os.scandir(entry.path) )
+            entries.append( (entry.stat().st_mtime, size, entry.path) )
+        except OSError:
+            continue    # removed by another process
+    totalBytes = sum( k[1] for k in entries )
+    for lastUsed, size, path in sorted(entries):
+        if totalBytes <= maxBytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        totalBytes -= size
+# End of cacheEvict()
+
+# function to find the line directories for batch mode
+#~batch: a root directory, every directory below it holding a tasktime.txt or line.npz is a line, or a glob pattern of
+#~       line directories
+def findLineDirs(batch):
+    if os.path.isdir(batch):
+        return sorted( root for root, dirs, files in os.walk(batch) if tasktimes_file in files or line_file in files )
+    return sorted( k for k in glob.glob(batch) if os.path.isdir(k) )
+# End of findLineDirs()
+
+# one line of the batch, a line that fails only fails its own entry in the summary
+#~With --profile the stages timed in the worker are handed back under 'profile', for runBatch() to merge
+def batchWorker(lineDir, args):
+    try:
+        with profiler.stage("balanceLine"):
+            summary = balanceLine(lineDir, args, parallelRender=False)
+    except Exception as e:
+        summary = { 'line': lineDir, 'status': 'error', 'error': type(e).__name__ + ": " + str(e) }
+    if profiler.enabled:
+        summary['profile'] = (profiler.events, profiler.counters)
+        profiler.clear()
+    return summary
+# End of batchWorker()
+
+# function to balance all the lines in batch mode, and write the summary of all the lines
+def runBatch(args):
+    lineDirs = findLineDirs(args.batch)
+    print("Found " + str(len(lineDirs)) + " line directories in " + args.batch)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        summaries = list(pool.map(batchWorker, lineDirs, [ args ] * len(lineDirs)))
+    for summary in summaries:
+        if 'profile' in summary:
+            events, counters = summary.pop('profile')
+            profiler.events += events
+            [ profiler.count(name, value) for name, value in counters.items() ]
+
+    summaryDir = args.summary_dir
+    if summaryDir is None:
+        summaryDir = args.batch if os.path.isdir(args.batch) else os.getcwd()
+    fieldNames = list()
+    [ fieldNames.append(k) for summary in summaries for k in summary.keys() if k not in fieldNames ]
+    with open(summaryDir + "/" + "Line_Balancing_Summary.csv", 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldNames)
+        writer.writeheader()
+        writer.writerows(summaries)
+    with open(summaryDir + "/" + "Line_Balancing_Summary.json", 'w') as f:
+        json.dump(summaries, f, indent=2)
+
+    failed = [ k for k in summaries if k['status'] != 'ok' ]
+    [ print("Failed " + k['line'] + ": " + k['error']) for k in failed ]
+    print("Balanced " + str(len(summaries)-len(failed)) + " of " + str(len(summaries)) + " lines, summary written to " + summaryDir)
+    return summaries
+# End of runBatch()
+
+# function to turn the result of balanceModel() into plain lists and numbers, for the JSON responses
+#~Each balanced line gives its cycle time, its metrics, and for each station the task ids, the task time and the
+#~idle time, as in the report
+def resultToDict(result):
+    lines = dict()
+    for name, balanced in result['balanced'].items():
+        if balanced is None:
+            continue
+        limit = result['limits'][name]
+        lines[name] = { 'cycle time': limit,
+                        'metrics': result['metrics'][name],
+                        'stations': [ { 'tasks': balanced.groups[k], 'task time': float(balanced.weights[k]),
+                                        'idle time': float(limit - balanced.weights[k]) } for k in range(balanced.numStations) ] }
+    return { 'takt time': result['takt time'], 'highest task time': result['highest task time'],
+             'total work time': result['total work time'], 'total task time': result['total task time'],
+             'balanced': lines }
+# End of resultToDict()
+
+# the lines held by each worker of the balancing service, and the positional weights for changed task times
+#~serveLines:   line id -> (version, line model, (work days, work hours, demand), task id -> task number, positional weights)
+#~serveWeights: (line id, version, changed task times) -> positional weights, the most recent serveWeightsSize of them
+serveLines = dict()
+serveWeights = dict()
+serveWeightsSize = 64
+
+def initServeWorker(lines):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # Ctrl-C stops the service, which then shuts the workers down
+    serveLines.update(lines)
+# End of initServeWorker()
+
+# one balancing query in a worker of the balancing service
+#~query: { 'line': line id, and optionally
+#~         'demand': the annual demand, 'worktime': [work days, work hours, demand], 'unit': 'hrs', 'min' or 'sec',
+#~         'stations': a fixed number of stations, 'task times': { task number: task time } for the tasks that change }
+#~The tasks are numbered from 1, as in edges_nodes.txt and the groups of the result.
+#~The positional weights of the line as loaded are worked out once when the line is loaded, a query that changes
+#~task times works them out again, and keeps them for the next query with the same changes.
+#~Returns the resultToDict() of the balancing, raises ValueError for a query that cannot be balanced
+def serveJob(lineId, version, query, unit):
+    lineVersion, line, worktimeDemand, idIndex, rpw_weights = serveLines[lineId]
+    if lineVersion != version:
+        raise ValueError("Line " + lineId + " changed while the query was running, send it again")
+
+    changes = query.get('task times') or {}
+    if not isinstance(changes, dict):
+        raise ValueError("'task times' is an object of task number: task time, got " + json.dumps(changes))
+    for name in ('demand', 'stations'):
+        if query.get(name) is not None and (isinstance(query[name], bool) or not isinstance(query[name], (int, float))):
+            raise ValueError("'" + name + "' must be a number, got " + json.dumps(query[name]))
+    if query.get('stations') is not None and not (query['stations'] >= 1 and query['stations'] == int(query['stations'])):
+        raise ValueError("'stations' must be a whole number of 1 or more, got " + json.dumps(query['stations']))
+    if changes:
+        times = line.times.copy()
+        for taskId, taskTime in changes.items():
+            if str(taskId) not in idIndex:
+                raise ValueError("Line " + lineId + " has no task " + str(taskId))
+            if not float(taskTime) > 0:
+                raise ValueError("The task time of task " + str(taskId) + " must be positive, got " + str(taskTime))
+            times[idIndex[str(taskId)]] = float(taskTime)
+        line = copy.copy(line)    # the precedence arrays are shared, only the task times change
+        line.times = times
+        key = (lineId, version, tuple(sorted( (str(k), float(times[idIndex[str(k)]])) for k in changes )))
+        rpw_weights = serveWeights.pop(key, None)
+        if rpw_weights is None:
+            rpw_weights = calculatePositionalWeights(line)
+        serveWeights[key] = rpw_weights    # most recently used at the end
+        if len(serveWeights) > serveWeightsSize:
+            del serveWeights[next(iter(serveWeights))]
+
+    worktime = list(query.get('worktime') or worktimeDemand)
+    if query.get('demand') is not None:
+        worktime[2] = query['demand']
+    if len(worktime) != 3 or not all( float(k) > 0 for k in worktime ):
+        raise ValueError("The work time is work days, work hours and the annual demand, all positive, got " + str(worktime))
+    unit = query.get('unit') or unit
+    if unit not in timeMultiplier:
+        raise ValueError("Unknown unit " + str(unit) + ", use one of " + ", ".join(timeMultiplier))
+    stations = query.get('stations')
+    result = balanceModel(line, worktime, unit, None if stations is None else int(stations), rpw_weights)
+    return dict(resultToDict(result), line=lineId, version=version)
+# End of serveJob()
+
+# the balancing service, the lines are kept in memory and the queries are balanced in a pool of worker processes
+#~The workers are started with a copy of every line and its positional weights, so a query only sends the line id
+#~and what changes. Loading or replacing a line starts a new pool with the new copy, queries already sent to the old
+#~pool finish there.
+class BalancingService:
+    def __init__(self, unit, jobs):
+        self.unit = unit
+        self.jobs = jobs
+        self.lines = dict()
+        self.lock = threading.Lock()       # held briefly, to read or swap the lines and the pool
+        self.putLock = threading.Lock()    # one line loaded at a time
+        self.pool = None
+
+    def startPool(self, lines):
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs, initializer=initServeWorker, initargs=(lines,))
+        [ k.result() for k in [ pool.submit(os.getpid) for j in range(self.jobs) ] ]    # start the workers now, not on the first query
+        return pool
+
+    # the entry of self.lines for a line, the version follows the one in lines
+    def lineEntry(self, lines, lineId, line, worktimeDemand):
+        rpw_weights = calculatePositionalWeights(line)    # also checks the precedence has no loop
+        idIndex = { k: i for i, k in enumerate(line.ids) }
+        version = lines[lineId][0] + 1 if lineId in lines else 1
+        return (version, line, tuple(worktimeDemand), idIndex, rpw_weights)
+
+    # add or replace a line without passing it on to the workers, for the lines loaded before the pool is started,
+    # returns its version
+    def addLine(self, lineId, line, worktimeDemand):
+        self.lines[lineId] = self.lineEntry(self.lines, lineId, line, worktimeDemand)
+        return self.lines[lineId][0]
+
+    # load or replace a line while the service runs, returns its version
+    #~The new pool is started with the new copy of the lines while the queries still go to the old pool with the
+    #~old versions, then the lines and the pool are swapped together, so a query never meets a version its pool
+    #~does not have.
+    def putLine(self, lineId, line, worktimeDemand):
+        with self.putLock:
+            with self.lock:
+                lines = dict(self.lines)
+            lines[lineId] = self.lineEntry(lines, lineId, line, worktimeDemand)
+            pool = self.startPool(lines)
+            with self.lock:
+                self.lines, oldPool, self.pool = lines, self.pool, pool
+        if oldPool is not None:
+            oldPool.shutdown(wait=False)
+        return lines[lineId][0]
+
+    def lineInfo(self, lineId):
+        version, line, worktimeDemand, idIndex, rpw_weights = self.lines[lineId]
+        return { 'line': lineId, 'version': version, 'tasks': line.numTasks, 'edges': line.numEdges,
+                 'worktime': list(worktimeDemand), 'task ids': line.ids, 'task names': line.names,
+                 'task times': line.times.tolist() }
+
+    # balance a list of queries concurrently, returns a result, or { 'error': ... }, for each query
+    def balance(self, queries):
+        futures = list()
+        with self.lock:
+            for query in queries:
+                lineId = str(query.get('line'))
+                if lineId not in self.lines:
+                    futures.append("Unknown line " + lineId)
+                else:
+                    futures.append(self.pool.submit(serveJob, lineId, self.lines[lineId][0], query, self.unit))
+        results = list()
+        for future in futures:
+            if isinstance(future, str):
+                results.append({ 'error': future })
+                continue
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # whatever is wrong with one query, it is answered with its error and the others still are
+                results.append({ 'error': type(e).__name__ + ": " + str(e) })
+        return results
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+# End of BalancingService
+
+# function to run the balancing service over HTTP until it is interrupted
+#~  GET  /lines           - the lines loaded, with their versions
+#~  GET  /lines/<id>      - one line, its task ids, names and times
+#~  PUT  /lines/<id>      - load or replace a line, { 'task times': [...], 'edges': [[from, to], ...], 'names': [...],
+#~                          'worktime': [work days, work hours, demand] }, the tasks in the edges are numbered from 1,
+#~                          as in edges_nodes.txt and in the 'task times' of a query
+#~  POST /balance         - one query, or a list of queries, see serveJob()
+#~The lines in --batch (or the line in -d) are loaded when the service starts, the line id is the directory name.
+def runServer(args):
+    import http.server
+    import urllib.parse
+
+    service = BalancingService(args.unit, max(1, args.jobs))
+    if args.batch:
+        lineDirs = findLineDirs(args.batch)
+        root = args.batch if os.path.isdir(args.batch) else None
+    else:
+        lineDirs = [ args.dir ]
+        root = None
+    for lineDir in lineDirs:
+        lineId = os.path.relpath(lineDir, root) if root else os.path.basename(os.path.normpath(lineDir))
+        line, worktimeDemand = loadLine(lineDir)
+        service.addLine(lineId, line, worktimeDemand)
+    service.pool = service.startPool(dict(service.lines))    # once, with every line
+
+    class ServeHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"    # keep the connection open between queries
+
+        def sendJson(self, status, content):
+            body = json.dumps(content).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def readJson(self):
+            return json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+
+        def lineId(self):
+            return urllib.parse.unquote(self.path[len("/lines/"):])
+
+        def do_GET(self):
+            if self.path == "/lines":
+                self.sendJson(200, [ service.lineInfo(k) for k in sorted(service.lines) ])
+            elif self.path.startswith("/lines/") and self.lineId() in service.lines:
+                self.sendJson(200, service.lineInfo(self.lineId()))
+            else:
+                self.sendJson(404, { 'error': "Not found: " + self.path })
+
+        def do_PUT(self):
+            if not self.path.startswith("/lines/") or not self.lineId():
+                return self.sendJson(404, { 'error': "Not found: " + self.path })
+            try:
+                content = self.readJson()
+                line = LineModel.fromTaskNumbers(content['task times'], content['edges'], content.get('names'))
+                version = service.putLine(self.lineId(), line, content['worktime'])
+            except Exception as e:
+                return self.sendJson(400, { 'error': type(e).__name__ + ": " + str(e) })
+            self.sendJson(200, { 'line': self.lineId(), 'version': version })
+
+        def do_POST(self):
+            if self.path != "/balance":
+                return self.sendJson(404, { 'error': "Not found: " + self.path })
+            try:
+                content = self.readJson()
+            except ValueError as e:
+                return self.sendJson(400, { 'error': "ValueError: " + str(e) })
+            if isinstance(content, dict):
+                result = service.balance([ content ])[0]
+                self.sendJson(400 if 'error' in result else 200, result)
+            elif isinstance(content, list) and all( isinstance(k, dict) for k in content ):
+                self.sendJson(200, service.balance(content))
+            else:
+                self.sendJson(400, { 'error': "A query is a JSON object, or a list of them" })
+
+        def log_message(self, format, *args):
+            pass    # hundreds of queries a second would flood the terminal
+    # End of ServeHandler
+
+    host, _, port = args.serve.rpartition(':')
+    server = http.server.ThreadingHTTPServer((host or "127.0.0.1", int(port)), ServeHandler)
+    print("Serving " + str(len(service.lines)) + " lines on http://" + (host or "127.0.0.1") + ":" + port + " with " + str(service.jobs) + " workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+# End of runServer()
+
+def main(argv):
+    args = cmdLineArgs(argv) 
+
+    print( " [~ " + str(time.strftime("%Y %b %d-%H:%M:%S")) + " Starting " + scriptName + " v"+ scriptVersion +"]" ) 
+    
+    profiler.enabled = args.profile
+    profileDir = args.dir
+    with profiler.stage("main"):
+        if args.convert:
+            line, worktimeDemand = loadLineText(args.dir)
+            saveLineNpz(args.dir + "/" + line_file, line, worktimeDemand)
+            print("Converted " + str(line.numTasks) + " tasks and " + str(line.numEdges) + " edges to " + args.dir + "/" + line_file)
+        elif args.serve:
+            runServer(args)
+        elif args.batch:
+            runBatch(args)
+            profileDir = args.summary_dir or (args.batch if os.path.isdir(args.batch) else os.getcwd())
+        else:
+            balanceLine(args.dir, args)
+
+    if profiler.enabled:
+        profiler.writeSummary(profileDir + "/" + "Line_Balancing_Profile.json")
+        profiler.writeChromeTrace(profileDir + "/" + "Line_Balancing_Trace.json")
 
     print( " [~ " + str(time.strftime("%Y %b %d-%H:%M:%S")) + " Ending " + scriptName + " v"+ scriptVersion +"]" ) # indicates the execution end of the script
 